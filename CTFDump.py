@@ -1,20 +1,37 @@
+import json
 import logging
 import os
+import sqlite3
 import sys
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from core import __version__
+from core import NotLoggedInException, __version__
+from core.batch import InvalidManifestException, SharedResources, load_manifest
+from core.index import ArchiveIndex
+from core.session import (
+    DEFAULT_BACKOFF,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+)
 from ctfs import CTFs
+from downloader import DownloadManager
 
 
 def main(args=None):
     if args is None:
         args = sys.argv[1:]
 
+    if args and args[0] == "batch":
+        return batch(args[1:])
+    if args and args[0] == "query":
+        return query(args[1:])
+
     # Initial parsing to get the platform
     platform = ",".join(CTFs.keys())
     initial_parser = ArgumentParser(
-        usage=f"%(prog)s {platform} <url> [-h] [-v] [-n] [-F] [-S LIMITSIZE]",
+        usage=f"%(prog)s {platform} <url> [-h] [-v] [-n] [-F] [-S LIMITSIZE] [-j JOBS] [-J DOWNLOAD_JOBS]",
         formatter_class=ArgumentDefaultsHelpFormatter,
         add_help=False,
     )
@@ -28,9 +45,20 @@ def main(args=None):
         exit(1)
 
     ctfs = CTFs.get(initial_args.ctfs)
+    parser = get_parser(ctfs, initial_args.ctfs)
+    sys_args = vars(parser.parse_args(args))
+    configure_logging()
+
+    ctf = create_ctf(ctfs, sys_args)
+    try:
+        run(ctf, sys_args)
+    finally:
+        ctf.close()
+
 
+def get_parser(ctfs, platform):
     parser = ArgumentParser(
-        usage=f"%(prog)s {{{initial_args.ctfs}}} <url> [-h] [-v] [-n] [-F] [-S LIMITSIZE] ",
+        usage=f"%(prog)s {{{platform}}} <url> [-h] [-v] [-n] [-F] [-S LIMITSIZE] [-j JOBS] [-J DOWNLOAD_JOBS] ",
         formatter_class=ArgumentDefaultsHelpFormatter,
     )
     ctfs.apply_argparser(parser)
@@ -38,6 +66,11 @@ def main(args=None):
     # Add global arguments
     parser.add_argument("ctfs")
     parser.add_argument("url", help="ctf url (for example: https://demo.ctfd.io/)")
+    add_arguments(parser)
+    return parser
+
+
+def add_arguments(parser):
     parser.add_argument(
         "-v",
         "--version",
@@ -57,31 +90,324 @@ def main(args=None):
         help="limit size of download file in Mb",
         default=100,
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="number of concurrent challenge detail requests",
+        default=1,
+    )
+    parser.add_argument(
+        "-J",
+        "--download-jobs",
+        type=int,
+        help="number of concurrent file downloads",
+        default=4,
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        help="max concurrent file downloads per host (0 for no limit)",
+        default=2,
+    )
+    parser.add_argument(
+        "--segments",
+        type=int,
+        help="split large files into this many parallel range requests",
+        default=1,
+    )
+    parser.add_argument(
+        "--store",
+        help="content addressed file store shared between challenges and events",
+    )
+    parser.add_argument(
+        "--max-extract-bytes",
+        type=int,
+        help="max bytes written when extracting an archive (0 for no limit)",
+        default=1024**3,
+    )
+    parser.add_argument(
+        "--max-extract-ratio",
+        type=float,
+        help="max expansion ratio of an archive (0 for no limit)",
+        default=100,
+    )
+    parser.add_argument(
+        "--extract-jobs",
+        type=int,
+        help="number of archive extraction processes (0 to extract inline)",
+        default=2,
+    )
+    parser.add_argument(
+        "--extract-depth",
+        type=int,
+        help="number of nested archive levels to extract",
+        default=1,
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        help="max bytes read from a download at once, reads grow up to this size",
+        default=DownloadManager.MAX_CHUNK_SIZE,
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        help="connections kept open per host (0 to size it from the number of jobs)",
+        default=0,
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        help="retries of failed connections and server errors",
+        default=DEFAULT_RETRIES,
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        help="exponential backoff factor between retries, in seconds",
+        default=DEFAULT_BACKOFF,
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="connect and read timeout of a request in seconds (0 for none)",
+        default=DEFAULT_TIMEOUT,
+    )
+    parser.add_argument(
+        "--rps",
+        type=float,
+        help="max requests per second to a single host (0 for no limit)",
+        default=0,
+    )
+    parser.add_argument(
+        "--index",
+        help="SQLite archive index updated with the challenges and files of every run",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="write a JSON summary of the run timings and counters to this file",
+    )
+    parser.add_argument(
+        "--prometheus",
+        help="write the run metrics to this Prometheus textfile (node_exporter)",
+    )
+    parser.add_argument(
+        "--session-ttl",
+        type=int,
+        help="seconds a saved login session is reused (0 to log in and out every run)",
+        default=6 * 60 * 60,
+    )
 
-    sys_args = vars(parser.parse_args(args))
 
-    # Configure Logger
+def configure_logging():
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s %(levelname)s %(message)s",
         datefmt="%d-%m-%y %H:%M:%S",
     )
 
-    ctf = ctfs(sys_args["url"], sys_args["limitsize"], sys_args["force"])
-    ctf.login(
-        sys_args,
-        no_login=(sys_args["no_login"] or os.environ.get("CTF_NO_LOGIN")),
-    )
+
+def create_ctf(ctfs, sys_args, **kwargs):
+    options = {
+        "jobs": sys_args["jobs"],
+        "download_jobs": sys_args["download_jobs"],
+        "per_host": sys_args["per_host"],
+        "segments": sys_args["segments"],
+        "store": sys_args["store"],
+        "max_extract_bytes": sys_args["max_extract_bytes"],
+        "max_extract_ratio": sys_args["max_extract_ratio"],
+        "extract_jobs": sys_args["extract_jobs"],
+        "extract_depth": sys_args["extract_depth"],
+        "chunk_size": sys_args["chunk_size"],
+        "pool_size": sys_args["pool_size"],
+        "retries": sys_args["retries"],
+        "backoff": sys_args["backoff"],
+        "timeout": sys_args["timeout"],
+        "rps": sys_args["rps"],
+        "index": sys_args["index"],
+    }
+    options.update(kwargs)
+    return ctfs(sys_args["url"], sys_args["limitsize"], sys_args["force"], **options)
+
+
+def run(ctf, sys_args):
+    no_login = sys_args["no_login"] or os.environ.get("CTF_NO_LOGIN")
+    keep_session = not no_login and sys_args["session_ttl"] > 0
+    is_restored = keep_session and ctf.load_session()
+    if is_restored:
+        ctf.logger.info("Saved session found, skipping login")
+    else:
+        with ctf.metrics.span("login"):
+            ctf.login(sys_args, no_login=no_login)
 
     # check available config
-    if ctf.load_config():
-        logging.info("Config file found, updating challenges")
+    has_config = ctf.load_config()
+    try:
+        dump(ctf, has_config)
+    except NotLoggedInException:
+        if not is_restored:
+            raise
+
+        ctf.logger.info("Saved session is no longer valid, logging in again")
+        ctf.clear_session()
+        with ctf.metrics.span("login"):
+            ctf.login(sys_args, no_login=no_login)
+        dump(ctf, has_config)
+
+    if keep_session:
+        ctf.save_session(sys_args["session_ttl"])
+    elif not sys_args["no_login"] or not os.environ.get("CTF_NO_LOGIN"):
+        ctf.logout()
+
+    ctf.report_metrics(sys_args["metrics"], sys_args["prometheus"])
+
+
+def dump(ctf, has_config):
+    if has_config:
+        ctf.logger.info("Config file found, updating challenges")
         ctf.update()
     else:
         ctf.save()
 
-    if not sys_args["no_login"] or not os.environ.get("CTF_NO_LOGIN"):
-        ctf.logout()
+
+def batch(args):
+    parser = ArgumentParser(
+        usage="%(prog)s batch <manifest> [-h] [-E EVENTS] [-J DOWNLOAD_JOBS] ",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("manifest", help="JSON file listing the events to dump")
+    parser.add_argument(
+        "-E", "--events", type=int, help="number of events dumped at once", default=4
+    )
+    add_arguments(parser)
+    batch_args = vars(parser.parse_args(args))
+    configure_logging()
+
+    # The options of the batch command line are the defaults of every event,
+    # the worker budget and connection pool options only apply to the batch
+    defaults = {
+        key: value
+        for key, value in batch_args.items()
+        if key not in ("manifest", "events")
+    }
+    runs = []
+    for event in load_manifest(batch_args["manifest"]):
+        ctfs = CTFs.get(event["platform"])
+        if ctfs is None:
+            raise InvalidManifestException(f'Unknown platform "{event["platform"]}"')
+        event_parser = get_parser(ctfs, event["platform"])
+        event_parser.set_defaults(**defaults)
+        sys_args = vars(
+            event_parser.parse_args([event["platform"], event["url"], *event["args"]])
+        )
+        runs.append((ctfs, sys_args, event["output"]))
+
+    shared = SharedResources(
+        batch_args["download_jobs"],
+        batch_args["per_host"],
+        batch_args["extract_jobs"],
+        batch_args["store"],
+    )
+    events = max(1, min(batch_args["events"], len(runs)))
+    pool_size = batch_args["pool_size"] or max(
+        DEFAULT_POOL_SIZE,
+        events * batch_args["jobs"]
+        + batch_args["download_jobs"] * max(1, batch_args["segments"]),
+    )
+    shared_options = {
+        "download_jobs": batch_args["download_jobs"],
+        "per_host": batch_args["per_host"],
+        "extract_jobs": batch_args["extract_jobs"],
+        "pool_size": pool_size,
+        "retries": batch_args["retries"],
+        "backoff": batch_args["backoff"],
+        "timeout": batch_args["timeout"],
+        "rps": batch_args["rps"],
+    }
+
+    def run_event(ctfs, sys_args, output_dir):
+        ctf = create_ctf(
+            ctfs, sys_args, output_dir=output_dir, shared=shared, **shared_options
+        )
+        try:
+            run(ctf, sys_args)
+        finally:
+            ctf.close()
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=events) as executor:
+        futures = {executor.submit(run_event, *event): event for event in runs}
+        for future in as_completed(futures):
+            output_dir = futures[future][2]
+            if future.exception() is not None:
+                logging.error(f"[{output_dir}] Failed: {future.exception()!r}")
+                failed.append(output_dir)
+            else:
+                logging.info(f"[{output_dir}] Done")
+
+    shared.close()
+    if failed:
+        logging.error(f"{len(failed)}/{len(runs)} events failed: {', '.join(failed)}")
+        exit(1)
+
+
+def query(args):
+    parser = ArgumentParser(
+        usage="%(prog)s query <index> [text] [-h] [-c CATEGORY] [-f FILE] [-d DIGEST] [-e EVENT] ",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("index", help="archive index written with --index")
+    parser.add_argument(
+        "text",
+        nargs="?",
+        help='full text query over names, categories and descriptions (for example: "heap AND tcache")',
+    )
+    parser.add_argument(
+        "-c", "--category", help="category of the challenge (%% as wildcard)"
+    )
+    parser.add_argument(
+        "-f", "--file", help="name of a file of the challenge (%% as wildcard)"
+    )
+    parser.add_argument("-d", "--digest", help="SHA-256 (or prefix) of a file")
+    parser.add_argument("-e", "--event", help="part of the event url or directory")
+    parser.add_argument(
+        "-l", "--limit", type=int, help="max number of results (0 for no limit)", default=100
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    query_args = vars(parser.parse_args(args))
+
+    if not os.path.exists(query_args["index"]):
+        print(f'Index "{query_args["index"]}" not found')
+        exit(1)
+
+    index = ArchiveIndex(query_args["index"])
+    try:
+        results = index.search(
+            text=query_args["text"],
+            category=query_args["category"],
+            file=query_args["file"],
+            digest=query_args["digest"],
+            event=query_args["event"],
+            limit=query_args["limit"],
+        )
+    except sqlite3.OperationalError as e:
+        # Malformed full text query
+        print(f"Invalid query: {e}")
+        exit(1)
+
+    if query_args["json"]:
+        print(json.dumps(results, indent=4))
+        return
+
+    for result in results:
+        print(
+            f"[{result['platform']}] {result['url']} "
+            f"[{result['category'] or 'No Category'}] {result['name']} ({result['value']})"
+        )
+        print(f"    {os.path.join(result['event'], result['path'])}")
+        for file in result["files"]:
+            print(f"    {file['digest'][:16]} {file['size']:>12} {file['path']}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Download throughput against a local HTTP server.
+
+Serves a random payload from memory and downloads it with a few chunk size
+settings of the DownloadManager, printing MB/s and CPU time for each one.
+
+    python benchmarks/bench_download.py --size 512
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloader import DownloadManager  # noqa: E402
+
+# (label, max chunk size), chunk sizes below CHUNK_SIZE are fixed
+CASES = [
+    ("fixed 1 KB", 1024),
+    ("fixed 64 KB", DownloadManager.CHUNK_SIZE),
+    ("adaptive 1 MB", 1024 * 1024),
+    ("adaptive 4 MB", DownloadManager.MAX_CHUNK_SIZE),
+    ("adaptive 16 MB", 16 * 1024 * 1024),
+]
+
+
+def make_handler(payload: bytes):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            view = memoryview(payload)
+            for start in range(0, len(payload), 1024 * 1024):
+                self.wfile.write(view[start : start + 1024 * 1024])
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def run_case(url: str, chunk_size: int, size: int) -> tuple:
+    logger = logging.getLogger("bench")
+    manager = DownloadManager(
+        requests.Session(), logger, True, size // (1024 * 1024) + 1, chunk_size=chunk_size
+    )
+    path = tempfile.mkdtemp(prefix="ctfdump-bench-")
+    try:
+        started, cpu_started = time.perf_counter(), time.process_time()
+        manager.invoke(url, path, "payload.bin")
+        elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+        assert os.path.getsize(os.path.join(path, "payload.bin")) == size
+    finally:
+        shutil.rmtree(path)
+    return elapsed, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=256, help="payload size in MB")
+    parser.add_argument("--rounds", type=int, default=3, help="runs per case, best is kept")
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(os.urandom(size)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/payload.bin"
+
+    print(f"{'case':<16} {'MB/s':>10} {'seconds':>10} {'cpu':>10}")
+    for label, chunk_size in CASES:
+        elapsed, cpu = min(run_case(url, chunk_size, size) for _ in range(args.rounds))
+        print(f"{label:<16} {args.size / elapsed:>10.1f} {elapsed:>10.2f} {cpu:>10.2f}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
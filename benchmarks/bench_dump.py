@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""End-to-end dump benchmark against a local mock platform.
+
+Starts a mock CTF (see mock_ctf.py) and runs CTFDump against it in a child
+process, first into an empty directory (cold) then again on the result
+(update). Prints the wall time, requests and requests per second seen by the
+server, MB and MB/s sent and the peak RSS of the CTFDump process. Arguments
+after "--" are passed to CTFDump.
+
+    python benchmarks/bench_dump.py CTFd --challenges 1000 --file-size 256K --latency 20 -- -j 8 -J 8
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_ctf import add_event_arguments, get_cli_platform, get_login_args, serve_from_args
+
+CTFDUMP = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "CTFDump.py"
+)
+# ru_maxrss is in KB on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def run_dump(args, output_dir, log):
+    """Run CTFDump once, returns the elapsed time and peak RSS in bytes"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, CTFDUMP, *args],
+        cwd=output_dir,
+        stdin=subprocess.DEVNULL,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"CTFDump exited with {process.returncode}, see {log.name}")
+    return elapsed, rusage.ru_maxrss * RSS_UNIT
+
+
+def main():
+    argv = sys.argv[1:]
+    extra = []
+    if "--" in argv:
+        extra = argv[argv.index("--") + 1 :]
+        argv = argv[: argv.index("--")]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_event_arguments(parser)
+    parser.add_argument("--rounds", type=int, default=1, help="cold and update runs to do")
+    parser.add_argument("--keep", action="store_true", help="keep the dumped directories")
+    args = parser.parse_args(argv)
+
+    server = serve_from_args(args)
+    # Files must never be skipped for their size
+    limit = max(100, args.file_size // (1024 * 1024) + 1)
+    dump_args = [
+        get_cli_platform(args.platform),
+        server.url,
+        *get_login_args(args.platform),
+        "-S",
+        str(limit),
+        *extra,
+    ]
+    event_size = server.event.total_size / 1024**2
+    print(
+        f"{args.platform}: {args.challenges} challenges, {len(server.event.files)} files, "
+        f"{event_size:.1f} MB, {args.latency:g} ms latency"
+    )
+    print(
+        f"{'run':<8} {'seconds':>9} {'requests':>9} {'req/s':>9} {'MB':>9} "
+        f"{'MB/s':>9} {'RSS MB':>9} {'500s':>6} {'429s':>6}"
+    )
+
+    for _ in range(args.rounds):
+        output_dir = tempfile.mkdtemp(prefix="ctfdump-bench-")
+        try:
+            with open(os.path.join(output_dir, "ctfdump.log"), "w") as log:
+                for label in ("cold", "update"):
+                    server.reset_stats()
+                    elapsed, rss = run_dump(dump_args, output_dir, log)
+                    stats = server.stats
+                    sent = stats["bytes_sent"] / 1024**2
+                    print(
+                        f"{label:<8} {elapsed:>9.2f} {stats['requests']:>9} "
+                        f"{stats['requests'] / elapsed:>9.1f} {sent:>9.1f} "
+                        f"{sent / elapsed:>9.1f} {rss / 1024**2:>9.1f} "
+                        f"{stats['failed']:>6} {stats['throttled']:>6}"
+                    )
+        finally:
+            if args.keep:
+                print(f"Kept {output_dir}")
+            else:
+                shutil.rmtree(output_dir)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
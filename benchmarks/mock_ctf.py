@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+"""Local stand-in CTF platforms for benchmarks.
+
+Serves a synthetic event through the endpoints the platform adapters use:
+CTFd v2 (/api/v1/challenges), CTFd v1 (/chals), rCTF (/api/v1/challs),
+GZctf (/api/game/{id}/details) and AD (/api/challenge). Files are generated
+on the fly, so events with thousands of challenges or GB files don't need
+memory or disk on the server side. Latency and failures (HTTP 500, HTTP 429
+with Retry-After) can be injected into every GET request.
+
+    python benchmarks/mock_ctf.py rCTF --challenges 1000 --file-size 1M --latency 20
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+PLATFORMS = ("CTFd", "CTFd1", "rCTF", "GZctf", "AD")
+CATEGORIES = ["web", "pwn", "crypto", "rev", "misc", "forensics"]
+WORDS = (
+    "heap libc tcache overflow format string kernel race jwt sqli xss ssrf "
+    "rsa lattice aes padding oracle vm obfuscated firmware pcap memory dump "
+    "the flag is hidden somewhere in this binary find it and submit"
+).split()
+GAME_ID = 1
+BLOCK_SIZE = 64 * 1024
+SIZE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*([KMG]?)B?$", re.IGNORECASE)
+
+
+def parse_size(size: str) -> int:
+    """Parse "512", "64K", "1.5M" or "2G" into bytes"""
+    match = SIZE_PATTERN.match(size.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size: {size!r}")
+    unit = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}[match.group(2).upper()]
+    return int(float(match.group(1)) * unit)
+
+
+class Event:
+    """Synthetic challenges, the same for a given seed"""
+
+    def __init__(
+        self,
+        challenges: int = 100,
+        files: int = 1,
+        file_size: int = 64 * 1024,
+        description_size: int = 500,
+        seed: int = 0,
+    ):
+        rng = random.Random(seed)
+        self.challenges: List[Dict] = []
+        self.files: Dict[str, int] = {}
+        for index in range(challenges):
+            challenge_id = index + 1
+            words = []
+            while sum(len(word) + 1 for word in words) < description_size:
+                words.append(rng.choice(WORDS))
+            challenge = {
+                "id": challenge_id,
+                "name": f"challenge {challenge_id}",
+                "category": CATEGORIES[index % len(CATEGORIES)],
+                "description": " ".join(words),
+                "value": 100 + 50 * (index % 10),
+                "files": [],
+            }
+            for file_index in range(files):
+                path = f"/files/{challenge_id}/file{file_index}.bin"
+                challenge["files"].append(path)
+                self.files[path] = file_size
+            self.challenges.append(challenge)
+
+    @property
+    def total_size(self) -> int:
+        return sum(self.files.values())
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        platform: str,
+        event: Event,
+        latency: float = 0,
+        jitter: float = 0,
+        fail_rate: float = 0,
+        throttle_rate: float = 0,
+        seed: int = 0,
+    ):
+        super().__init__(address, Handler)
+        self.platform = platform
+        self.event = event
+        self.by_id = {challenge["id"]: challenge for challenge in event.challenges}
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/"
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.stats = {
+                "requests": 0,
+                "files": 0,
+                "not_modified": 0,
+                "bytes_sent": 0,
+                "failed": 0,
+                "throttled": 0,
+            }
+
+    def count(self, key: str, value: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += value
+
+    def draw(self) -> float:
+        with self.lock:
+            return self.random.random()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status: int = 200) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count("bytes_sent", len(body))
+
+    def send_empty(self, status: int, headers: Optional[Dict] = None) -> None:
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def absolute(self, path: str) -> str:
+        return f"http://{self.headers.get('Host')}{path}"
+
+    def inject(self) -> bool:
+        """Delay the request and maybe fail it, True if a failure was sent"""
+        server = self.server
+        delay = server.latency + server.jitter * server.draw()
+        if delay:
+            time.sleep(delay)
+
+        draw = server.draw()
+        if draw < server.fail_rate:
+            server.count("failed")
+            self.send_empty(500)
+            return True
+        if draw < server.fail_rate + server.throttle_rate:
+            server.count("throttled")
+            self.send_empty(429, {"Retry-After": "1"})
+            return True
+        return False
+
+    def do_POST(self):
+        self.server.count("requests")
+        self.read_body()
+        path = urlparse(self.path).path
+        platform = self.server.platform
+        # Any credentials are accepted, logins are never failed
+        if platform == "rCTF" and path == "/api/v1/auth/login":
+            self.send_json({"kind": "goodLogin", "data": {"authToken": "token"}})
+        elif platform == "GZctf" and path == "/api/account/login":
+            self.send_json({"succeeded": True})
+        elif platform == "AD" and path == "/api/user/login":
+            self.send_json({"success": True, "data": {"token": "token"}})
+        else:
+            self.send_empty(404)
+
+    def do_GET(self):
+        self.server.count("requests")
+        if self.inject():
+            return
+
+        path = urlparse(self.path).path
+        if path.startswith("/files/"):
+            return self.send_file(path)
+        if path == "/logout":
+            return self.send_empty(200)
+
+        route = getattr(self, f"get_{self.server.platform}")
+        data = route(path)
+        if data is None:
+            return self.send_empty(404)
+        self.send_json(data)
+
+    def get_challenge_id(self, path: str, prefix: str) -> Optional[Dict]:
+        match = re.fullmatch(re.escape(prefix) + r"(\d+)", path)
+        return self.server.by_id.get(int(match.group(1))) if match else None
+
+    def get_CTFd(self, path: str):
+        if path == "/api/v1/challenges":
+            # Like CTFd, the list has no descriptions nor files
+            return {
+                "success": True,
+                "data": [
+                    {key: challenge[key] for key in ("id", "name", "category", "value")}
+                    for challenge in self.server.event.challenges
+                ],
+            }
+        challenge = self.get_challenge_id(path, "/api/v1/challenges/")
+        if challenge is not None:
+            return {
+                "success": True,
+                "data": {
+                    **challenge,
+                    "files": [f"{file}?token=token" for file in challenge["files"]],
+                },
+            }
+        return None
+
+    def get_CTFd1(self, path: str):
+        if path == "/chals":
+            return {
+                "game": [
+                    {key: challenge[key] for key in ("id", "name", "category", "value")}
+                    for challenge in self.server.event.challenges
+                ]
+            }
+        challenge = self.get_challenge_id(path, "/chals/")
+        if challenge is not None:
+            return {
+                **challenge,
+                "files": [file[len("/files/"):] for file in challenge["files"]],
+            }
+        return None
+
+    def get_rCTF(self, path: str):
+        if path != "/api/v1/challs":
+            return None
+        return {
+            "kind": "goodChallenges",
+            "data": [
+                {
+                    "id": challenge["id"],
+                    "name": challenge["name"],
+                    "category": challenge["category"],
+                    "description": challenge["description"],
+                    "points": challenge["value"],
+                    "files": [
+                        {"name": file.rsplit("/", 1)[1], "url": self.absolute(file)}
+                        for file in challenge["files"]
+                    ],
+                }
+                for challenge in self.server.event.challenges
+            ],
+        }
+
+    def get_GZctf(self, path: str):
+        if path == f"/api/game/{GAME_ID}/details":
+            challenges = {}
+            for challenge in self.server.event.challenges:
+                challenges.setdefault(challenge["category"], []).append(
+                    {"id": challenge["id"], "title": challenge["name"]}
+                )
+            return {"challenges": challenges}
+        challenge = self.get_challenge_id(path, f"/api/game/{GAME_ID}/challenges/")
+        if challenge is not None:
+            # GZctf has a single attachment per challenge
+            return {
+                "id": challenge["id"],
+                "title": challenge["name"],
+                "tag": challenge["category"],
+                "content": challenge["description"],
+                "context": {"url": challenge["files"][0] if challenge["files"] else None},
+            }
+        return None
+
+    def get_AD(self, path: str):
+        if path != "/api/challenge":
+            return None
+        # AD has a single attachment per challenge
+        return {
+            "data": [
+                {
+                    "id": challenge["id"],
+                    "name": challenge["name"],
+                    "description": challenge["description"],
+                    "attachment": self.absolute(challenge["files"][0]),
+                }
+                for challenge in self.server.event.challenges
+                if challenge["files"]
+            ]
+        }
+
+    def send_file(self, path: str) -> None:
+        size = self.server.event.files.get(path)
+        if size is None:
+            return self.send_empty(404)
+
+        etag = f'"{hashlib.sha1(f"{path}:{size}".encode()).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.server.count("not_modified")
+            return self.send_empty(304, {"ETag": etag})
+
+        start, end = 0, size - 1
+        status = 200
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if match and (not if_range or if_range == etag) and int(match.group(1)) < size:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or size - 1), size - 1)
+            status = 206
+
+        self.server.count("files")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", etag)
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+
+        # Every file repeats a block derived from its path
+        seed = hashlib.sha256(path.encode()).digest()
+        block = (seed * (BLOCK_SIZE // len(seed) + 1))[:BLOCK_SIZE]
+        view = memoryview(block)
+        position = start
+        try:
+            while position <= end:
+                offset = position % BLOCK_SIZE
+                length = min(BLOCK_SIZE - offset, end + 1 - position)
+                self.wfile.write(view[offset : offset + length])
+                position += length
+        finally:
+            self.server.count("bytes_sent", position - start)
+
+
+def serve(platform: str, event: Event, port: int = 0, **options) -> MockServer:
+    """
+    Start a mock platform in a background thread
+
+    Args:
+        platform: One of PLATFORMS
+        event: Challenges and files to serve
+        port: Port to listen on, 0 for any free port
+        options: latency, jitter (seconds), fail_rate, throttle_rate, seed
+
+    Returns:
+        Running server, stop it with shutdown()
+    """
+    if platform not in PLATFORMS:
+        raise ValueError(f"Unknown platform {platform!r}, expected one of {PLATFORMS}")
+    server = MockServer(("127.0.0.1", port), platform, event, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_login_args(platform: str) -> List[str]:
+    """CTFDump arguments logging into (or skipping the login of) a mock"""
+    if platform in ("CTFd", "CTFd1"):
+        return ["-n"]
+    if platform == "rCTF":
+        return ["-t", "token"]
+    if platform == "GZctf":
+        return ["-u", "user", "-p", "password", "-id", str(GAME_ID)]
+    return ["-u", "user", "-p", "password"]
+
+
+def get_cli_platform(platform: str) -> str:
+    return "CTFd" if platform == "CTFd1" else platform
+
+
+def add_event_arguments(parser) -> None:
+    parser.add_argument("platform", choices=PLATFORMS, help="platform to mimic")
+    parser.add_argument("--challenges", type=int, default=100, help="number of challenges")
+    parser.add_argument("--files", type=int, default=1, help="files per challenge")
+    parser.add_argument(
+        "--file-size", type=parse_size, default="64K", help="size of every file (K, M, G)"
+    )
+    parser.add_argument(
+        "--description-size", type=int, default=500, help="characters per description"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0, help="delay added to every GET, in ms"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0, help="random extra delay up to this many ms"
+    )
+    parser.add_argument(
+        "--fail-rate", type=float, default=0, help="share of GETs answered with HTTP 500"
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0,
+        help="share of GETs answered with HTTP 429 and Retry-After",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of the event and failures")
+
+
+def serve_from_args(args, port: int = 0) -> MockServer:
+    event = Event(
+        args.challenges, args.files, args.file_size, args.description_size, args.seed
+    )
+    return serve(
+        args.platform,
+        event,
+        port,
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        fail_rate=args.fail_rate,
+        throttle_rate=args.throttle_rate,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_event_arguments(parser)
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    args = parser.parse_args()
+
+    server = serve_from_args(args, args.port)
+    print(f"Serving {args.platform} with {args.challenges} challenges on {server.url}")
+    print(
+        "    python CTFDump.py "
+        + " ".join([get_cli_platform(args.platform), server.url, *get_login_args(args.platform)])
+    )
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
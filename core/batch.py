@@ -0,0 +1,91 @@
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from downloader.scheduler import DownloadScheduler
+from downloader.store import BlobStore
+
+
+class InvalidManifestException(Exception):
+    pass
+
+
+class SharedResources(object):
+    """Worker budget and connection pool shared by the events of a batch.
+
+    Every event keeps its own session (cookies, tokens) and DownloadManager,
+    but they all queue downloads on one scheduler, extract in one process
+    pool, link files through one store and send requests through the same
+    pooled, rate limited adapters.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        per_host: int = 0,
+        extract_jobs: int = 0,
+        store_path: Optional[str] = None,
+    ):
+        self.scheduler = DownloadScheduler(workers, per_host)
+        self.extract_pool = None
+        if extract_jobs:
+            self.extract_pool = ProcessPoolExecutor(
+                max_workers=extract_jobs,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        self.store = BlobStore(store_path) if store_path else None
+        # Adapters by TLS verification mode, created by the first session
+        self.adapters: Dict = {}
+
+    def close(self) -> None:
+        self.scheduler.shutdown()
+        if self.extract_pool is not None:
+            self.extract_pool.shutdown()
+        for adapters in self.adapters.values():
+            for adapter in adapters.values():
+                adapter.close()
+
+
+def load_manifest(filepath: str) -> List[Dict]:
+    """
+    Read the events of a batch
+
+    The manifest is a JSON list of events, or an object with an "events"
+    list and "args" added to the arguments of every event. An event has a
+    "platform", a "url", an "output" directory and optional "args", the
+    command line arguments of a single run:
+
+        {
+            "args": ["-J", "4"],
+            "events": [
+                {"platform": "CTFd", "url": "https://demo.ctfd.io/",
+                 "output": "demo", "args": ["-u", "user", "-p", "password"]}
+            ]
+        }
+
+    Returns:
+        Events with the common arguments merged into their "args"
+    """
+    with open(filepath, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if isinstance(manifest, list):
+        manifest = {"events": manifest}
+
+    common_args = manifest.get("args", [])
+    events = []
+    outputs = set()
+    for event in manifest.get("events", []):
+        missing = [key for key in ("platform", "url", "output") if not event.get(key)]
+        if missing:
+            raise InvalidManifestException(
+                f"Event {event!r} is missing {', '.join(missing)}"
+            )
+        if event["output"] in outputs:
+            raise InvalidManifestException(
+                f'Output directory "{event["output"]}" is used by several events'
+            )
+        outputs.add(event["output"])
+        events.append({**event, "args": [*common_args, *event.get("args", [])]})
+    return events
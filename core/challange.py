@@ -1,21 +1,60 @@
 import codecs
+import hashlib
+import json
 import logging
 import os
 import re
 from os import path
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
-from downloader import DownloadManager
+
+logger = logging.getLogger(__name__)
+
+URL_PATTERN = re.compile(r"https?:\/\/\w+(?:\.\w+)+(?:\/[?=&\w._-]+)+", re.DOTALL)
+ESCAPE_PATTERN = re.compile(r"[^\w\s\-.()]")
 
 
 class Challenge(object):
-    def __init__(self, ctf, name, category="", description="", files=None, value=0):
+    # Loading and diffing big archives creates many instances, keep them small
+    __slots__ = (
+        "ctf",
+        "challenge_id",
+        "name",
+        "category",
+        "description",
+        "value",
+        "_files",
+        "_collected_files",
+        "_fingerprint",
+    )
+
+    def __init__(
+        self,
+        ctf,
+        name,
+        category="",
+        description="",
+        files=None,
+        value=0,
+        challenge_id=None,
+        fingerprint=None,
+    ):
         self.ctf = ctf
+        self.challenge_id = challenge_id
         self.name = name
         self.category = category
         self.description = description
-        self.logger = logging.getLogger(__name__)
-        self.files = self.collect_files(files, description)
         self.value = value
+        self._files = files
+        self._collected_files = None
+        self._fingerprint = fingerprint
+
+    @property
+    def files(self):
+        # Description URLs are only extracted when the files are needed
+        if self._collected_files is None:
+            self._collected_files = self.collect_files(self._files, self.description)
+        return self._collected_files
 
     def __str__(self):
         return f'<"{self.name}" ({self.category} - {self.value})>'
@@ -24,21 +63,51 @@ class Challenge(object):
         return self.__str__()
 
     def __eq__(self, value: object) -> bool:
-        return (
-            self.name == value.name
-            and self.category == value.category
-            and self.description == value.description
-            and self.files == value.files
-            and self.value == value.value
-        )
+        return self.fingerprint == value.fingerprint
+
+    @property
+    def fingerprint(self):
+        # SHA-256 of the normalized metadata, loaded challenges reuse the hash
+        # saved in challenges.json
+        if self._fingerprint is None:
+            content = json.dumps(
+                {
+                    "name": self.name.strip(),
+                    "category": self.category.strip(),
+                    "description": self.normalize_text(self.description),
+                    "files": sorted(map(self.normalize_url, self.files)),
+                    "value": self.value,
+                },
+                sort_keys=True,
+            )
+            self._fingerprint = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        return self._fingerprint
+
+    @staticmethod
+    def normalize_text(text):
+        return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+    @staticmethod
+    def normalize_url(url):
+        # Signed download tokens change between sessions, not between versions
+        parsed = urlparse(url)
+        query = [(k, v) for k, v in parse_qsl(parsed.query) if k != "token"]
+        return urlunparse(parsed._replace(query=urlencode(query)))
+
+    @property
+    def key(self):
+        # Identity used to match challenges between runs
+        return (self.category, self.name)
 
     def to_dict(self):
         return {
+            "id": self.challenge_id,
             "name": self.name,
             "category": self.category,
             "description": self.description,
             "files": self.files,
             "value": self.value,
+            "hash": self.fingerprint,
         }
 
     @staticmethod
@@ -50,21 +119,22 @@ class Challenge(object):
             description=data["description"],
             files=data["files"],
             value=data["value"],
+            challenge_id=data.get("id"),
+            fingerprint=data.get("hash"),
         )
 
     @staticmethod
     def collect_files(files, description=""):
-        files = files or []
-        files.extend(
-            re.findall(
-                r"https?:\/\/\w+(?:\.\w+)+(?:\/[?=&\w._-]+)+", description, re.DOTALL
-            )
-        )
+        files = list(files or [])
+        for url in URL_PATTERN.findall(description):
+            # Files loaded from the config already hold the description URLs
+            if url not in files:
+                files.append(url)
         return files
 
     @staticmethod
     def escape_filename(filename):
-        return re.sub(r"[^\w\s\-.()]", "", filename.strip()).replace(" ", "_")
+        return ESCAPE_PATTERN.sub("", filename.strip()).replace(" ", "_")
 
     def get_challenge_path(self):
         return path.join(
@@ -72,22 +142,40 @@ class Challenge(object):
         ).replace(" ", "_")
 
     def download_all_files(self):
-        manager = DownloadManager.get_instance()
+        manager = self.ctf.downloader
+        challenge_path = self.ctf.get_path(self.get_challenge_path())
+        futures = []
         for file_url in self.files:
-            try:
-                manager.download(file_url, self.get_challenge_path())
-            except Exception as e:
-                self.logger.error(f"Failed to download {file_url}: {e}")
-                continue
+            future = manager.submit(file_url, challenge_path)
+            future.add_done_callback(
+                lambda f, file_url=file_url: self._log_download_failure(f, file_url)
+            )
+            futures.append(future)
+        return futures
+
+    def _log_download_failure(self, future, file_url):
+        if future.exception() is not None:
+            logger.error(f"Failed to download {file_url}: {future.exception()}")
+
+    def render(self):
+        return (
+            f"Name: {self.name}\n"
+            f"Value: {self.value}\n"
+            f"Description: {self.description}\n"
+        )
 
     def dump(self):
         # Create challenge directory if not exist
-        challenge_path = self.get_challenge_path()
+        challenge_path = self.ctf.get_path(self.get_challenge_path())
         os.makedirs(challenge_path, exist_ok=True)
 
-        with codecs.open(
-            path.join(challenge_path, "ReadMe.md"), "wb", encoding="utf-8"
-        ) as f:
-            f.write(f"Name: {self.name}\n")
-            f.write(f"Value: {self.value}\n")
-            f.write(f"Description: {self.description}\n")
+        readme_path = path.join(challenge_path, "ReadMe.md")
+        content = self.render()
+        if path.exists(readme_path):
+            # Keep the mtime of an unchanged ReadMe.md (rsync mirrors)
+            with codecs.open(readme_path, "rb", encoding="utf-8") as f:
+                if f.read() == content:
+                    return
+
+        with codecs.open(readme_path, "wb", encoding="utf-8") as f:
+            f.write(content)
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncGenerator, Generator, Optional
+
+
+class AsyncClient:
+    """Awaitable requests on top of the session of a platform.
+
+    The session stays the single source of cookies, headers, connection pool,
+    retries and rate limiting (and of the cloudscraper challenge handling, which
+    has no asyncio counterpart). Blocking calls run on a pool of ``concurrency``
+    threads, so any number of coroutines can await requests from one event loop
+    while at most ``concurrency`` of them are on the wire.
+    """
+
+    def __init__(self, session, concurrency: int = 1):
+        self.session = session
+        self.concurrency = max(1, concurrency)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    async def run(self, func, *args, **kwargs) -> Any:
+        """Await a blocking callable on the client threads"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), partial(func, *args, **kwargs)
+        )
+
+    async def request(self, method: str, url: str, **kwargs):
+        return await self.run(self.session.request, method, url, **kwargs)
+
+    async def get(self, url: str, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.concurrency, thread_name_prefix="client"
+                )
+            return self._executor
+
+
+def iter_sync(agen: AsyncGenerator) -> Generator:
+    """
+    Drive an async generator from synchronous code
+
+    Items are yielded as soon as they are produced, so a caller can process
+    one while the requests of the next ones are still in flight.
+
+    Args:
+        agen: Async generator to consume
+
+    Returns:
+        Generator of the items of agen
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
@@ -0,0 +1,311 @@
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from downloader import DownloadManager
+from downloader.extract import EXTRACTED_MARKER
+from downloader.store import BlobStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    platform TEXT NOT NULL,
+    url TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS challenges (
+    id INTEGER PRIMARY KEY,
+    event_id INTEGER NOT NULL REFERENCES events(id) ON DELETE CASCADE,
+    challenge_id TEXT,
+    name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    description TEXT NOT NULL,
+    value INTEGER,
+    hash TEXT,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS challenges_event ON challenges(event_id);
+CREATE INDEX IF NOT EXISTS challenges_category ON challenges(category COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    challenge_id INTEGER NOT NULL REFERENCES challenges(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_challenge ON files(challenge_id);
+CREATE INDEX IF NOT EXISTS files_digest ON files(digest);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS challenges_fts
+USING fts5(name, category, description);
+"""
+
+
+class ArchiveIndex:
+    """SQLite index of dumped events.
+
+    Holds the challenges of every indexed event with their files (downloads
+    and extracted content) and SHA-256 digests, and a full text index of
+    names, categories and descriptions when SQLite is built with FTS5. An
+    event is replaced as a whole every time it is indexed, digests of files
+    whose size and mtime didn't change are reused.
+    """
+
+    SKIPPED_FILES = ("ReadMe.md",)
+    # Left by the downloader: partial downloads, their journals, store links
+    # being placed and the markers of extracted archives
+    SKIPPED_SUFFIXES = (DownloadManager.PART_SUFFIX, DownloadManager.JOURNAL_SUFFIX)
+    STORE_LINK_PATTERN = re.compile(r"\.[0-9a-f]{8}\.tmp$")
+    MARKER_PREFIX, MARKER_SUFFIX = EXTRACTED_MARKER.split("{}")
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+            try:
+                conn.executescript(FTS_SCHEMA)
+                self.has_fts = True
+            except sqlite3.OperationalError:
+                # SQLite without FTS5, descriptions are searched with LIKE
+                self.has_fts = False
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per operation, the events of a batch index from
+        # several threads and WAL lets queries run while they write
+        conn = sqlite3.connect(self.filepath, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @classmethod
+    def _is_bookkeeping(cls, filename: str) -> bool:
+        if filename.endswith(cls.SKIPPED_SUFFIXES):
+            return True
+        if cls.STORE_LINK_PATTERN.search(filename):
+            return True
+        return filename.startswith(cls.MARKER_PREFIX) and filename.endswith(cls.MARKER_SUFFIX)
+
+    def _scan_files(self, root: str, challenge_path: str, known: Dict) -> List[Dict]:
+        files = []
+        challenge_root = os.path.join(root, challenge_path)
+        for dirpath, _, filenames in os.walk(challenge_root):
+            for filename in filenames:
+                if dirpath == challenge_root and filename in self.SKIPPED_FILES:
+                    continue
+                if self._is_bookkeeping(filename):
+                    continue
+                filepath = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(filepath, root)
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    continue
+
+                old = known.get(relpath)
+                if old and old["size"] == stat.st_size and old["mtime"] == stat.st_mtime:
+                    digest = old["digest"]
+                else:
+                    try:
+                        digest = BlobStore.hash_file(filepath)
+                    except OSError:
+                        continue
+                files.append(
+                    {
+                        "path": relpath,
+                        "name": filename,
+                        "size": stat.st_size,
+                        "mtime": stat.st_mtime,
+                        "digest": digest,
+                    }
+                )
+        return files
+
+    def add_event(self, ctf) -> None:
+        """
+        Index (or re-index) the challenges of an event
+
+        Args:
+            ctf: Platform whose challenges and output directory are indexed
+        """
+        root = os.path.abspath(ctf.output_dir or ".")
+        conn = self._connect()
+        try:
+            known = {
+                file["path"]: file
+                for file in conn.execute(
+                    "SELECT files.path, size, mtime, digest FROM files "
+                    "JOIN challenges ON challenges.id = files.challenge_id "
+                    "JOIN events ON events.id = challenges.event_id "
+                    "WHERE events.path = ?",
+                    (root,),
+                )
+            }
+            # Files are hashed before the write transaction, other events of
+            # a batch are not locked out while this one is read from disk
+            challenges = [
+                (
+                    challenge,
+                    self._scan_files(root, challenge.get_challenge_path(), known),
+                )
+                for challenge in ctf.challanges
+            ]
+
+            # Committed as a whole, queries never see a half indexed event
+            with conn:
+                self._write_event(conn, ctf, root, challenges)
+        finally:
+            conn.close()
+
+    def _write_event(self, conn, ctf, root, challenges) -> None:
+        row = conn.execute("SELECT id FROM events WHERE path = ?", (root,)).fetchone()
+        if row is not None:
+            event_id = row["id"]
+            if self.has_fts:
+                conn.execute(
+                    "DELETE FROM challenges_fts WHERE rowid IN "
+                    "(SELECT id FROM challenges WHERE event_id = ?)",
+                    (event_id,),
+                )
+            conn.execute("DELETE FROM challenges WHERE event_id = ?", (event_id,))
+            conn.execute(
+                "UPDATE events SET platform = ?, url = ?, updated = ? WHERE id = ?",
+                (ctf.name, ctf.url, time.time(), event_id),
+            )
+        else:
+            event_id = conn.execute(
+                "INSERT INTO events (path, platform, url, updated) VALUES (?, ?, ?, ?)",
+                (root, ctf.name, ctf.url, time.time()),
+            ).lastrowid
+
+        for challenge, files in challenges:
+            rowid = conn.execute(
+                "INSERT INTO challenges (event_id, challenge_id, name, category, "
+                "description, value, hash, path) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    event_id,
+                    None if challenge.challenge_id is None else str(challenge.challenge_id),
+                    challenge.name,
+                    challenge.category or "",
+                    challenge.description or "",
+                    challenge.value,
+                    challenge.fingerprint,
+                    challenge.get_challenge_path(),
+                ),
+            ).lastrowid
+            if self.has_fts:
+                conn.execute(
+                    "INSERT INTO challenges_fts (rowid, name, category, description) "
+                    "VALUES (?, ?, ?, ?)",
+                    (
+                        rowid,
+                        challenge.name,
+                        challenge.category or "",
+                        challenge.description or "",
+                    ),
+                )
+            conn.executemany(
+                "INSERT INTO files (challenge_id, path, name, size, mtime, digest) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (rowid, f["path"], f["name"], f["size"], f["mtime"], f["digest"])
+                    for f in files
+                ],
+            )
+
+    def search(
+        self,
+        text: Optional[str] = None,
+        category: Optional[str] = None,
+        file: Optional[str] = None,
+        digest: Optional[str] = None,
+        event: Optional[str] = None,
+        limit: int = 100,
+    ) -> List[Dict]:
+        """
+        Find indexed challenges
+
+        Args:
+            text: Full text query over names, categories and descriptions
+                (FTS5 syntax, e.g. ``heap AND tcache``)
+            category: Category name, case insensitive, ``%`` as wildcard
+            file: Name of a file of the challenge, ``%`` as wildcard
+            digest: SHA-256 (or a prefix of it) of a file of the challenge
+            event: Part of the URL or directory of the event
+            limit: Max number of results (0 for no limit)
+
+        Returns:
+            Matching challenges with their event and files, best matches first
+            when searching text
+        """
+        query = (
+            "SELECT challenges.id, events.platform, events.url, events.path AS event, "
+            "challenges.name, challenges.category, challenges.value, challenges.path "
+            "FROM challenges JOIN events ON events.id = challenges.event_id"
+        )
+        where = []
+        params: List = []
+        order = "events.path, challenges.category, challenges.name"
+        if text:
+            if self.has_fts:
+                query += " JOIN challenges_fts ON challenges_fts.rowid = challenges.id"
+                where.append("challenges_fts MATCH ?")
+                params.append(text)
+                order = "challenges_fts.rank"
+            else:
+                where.append(
+                    "(challenges.name || ' ' || challenges.category || ' ' || "
+                    "challenges.description) LIKE ?"
+                )
+                params.append(f"%{text}%")
+        if category:
+            where.append("challenges.category LIKE ?")
+            params.append(category)
+        if file:
+            where.append(
+                "EXISTS (SELECT 1 FROM files WHERE files.challenge_id = challenges.id "
+                "AND files.name LIKE ?)"
+            )
+            params.append(file)
+        if digest:
+            where.append(
+                "EXISTS (SELECT 1 FROM files WHERE files.challenge_id = challenges.id "
+                "AND files.digest LIKE ?)"
+            )
+            params.append(f"{digest.lower()}%")
+        if event:
+            where.append("(events.url LIKE ? OR events.path LIKE ?)")
+            params += [f"%{event}%", f"%{event}%"]
+
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += f" ORDER BY {order}"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        conn = self._connect()
+        try:
+            results = [dict(row) for row in conn.execute(query, params)]
+            for result in results:
+                result["files"] = [
+                    dict(row)
+                    for row in conn.execute(
+                        "SELECT path, size, digest FROM files "
+                        "WHERE challenge_id = ? ORDER BY path",
+                        (result.pop("id"),),
+                    )
+                ]
+        finally:
+            conn.close()
+        return results
@@ -0,0 +1,59 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+
+class Journal(object):
+    """Append-only JSON lines file.
+
+    Every record is written and flushed as soon as it is appended, so the
+    work done before a crash can be replayed by the next run. A torn last
+    line (the process died mid write) is ignored when reading.
+    """
+
+    def __init__(self, filepath: str, header: Optional[Dict] = None):
+        """
+        Args:
+            filepath: Path of the journal
+            header: First record of a new journal, identifies its owner
+        """
+        self.filepath = filepath
+        self.header = header
+        self._file = None
+        self._lock = threading.Lock()
+
+    def append(self, record: Dict) -> None:
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.filepath, "a", encoding="utf-8")
+                if self.header is not None and self._file.tell() == 0:
+                    line = json.dumps(self.header) + "\n" + line
+            self._file.write(line)
+            self._file.flush()
+
+    def read(self) -> List[Dict]:
+        if not os.path.exists(self.filepath):
+            return []
+
+        records = []
+        with open(self.filepath, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return records
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self) -> None:
+        """Drop the journal once its records are compacted"""
+        self.close()
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
@@ -0,0 +1,175 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+PROMETHEUS_PREFIX = "ctfdump"
+
+
+class Metrics:
+    """Counters and timing spans of a run.
+
+    Counters add up events (requests, bytes, skipped files) and may carry a
+    reason, spans add up the time spent in a phase (login, enumeration, one
+    download) with their count and slowest occurrence. Everything is thread
+    safe, downloads and extractions report from their worker threads.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters: Dict[Tuple[str, Optional[str]], float] = {}
+        self.spans: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, value: float = 1, reason: Optional[str] = None) -> None:
+        key = (name, reason)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Add one occurrence of a span measured elsewhere"""
+        with self._lock:
+            span = self.spans.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            span["count"] += 1
+            span["total"] += seconds
+            span["max"] = max(span["max"], seconds)
+
+    @contextmanager
+    def span(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def get(self, name: str) -> float:
+        with self._lock:
+            return sum(
+                value for (key, _), value in self.counters.items() if key == name
+            )
+
+    def on_response(self, response, *args, **kwargs) -> None:
+        """Response hook of a session, counts requests, statuses and retries"""
+        self.incr("requests")
+        self.incr("responses", reason=f"{response.status_code // 100}xx")
+        retries = getattr(response.raw, "retries", None)
+        if retries is not None and retries.history:
+            self.incr("retries", len(retries.history))
+        throttled = getattr(response, "throttled", 0)
+        if throttled:
+            self.incr("throttled", throttled)
+
+    def summary(self) -> Dict:
+        """
+        Build the JSON summary of the run
+
+        Returns:
+            Elapsed time, counters (by reason when they have one), spans and
+            the download throughput
+        """
+        elapsed = time.time() - self.started
+        with self._lock:
+            by_reason: Dict[str, Dict] = {}
+            for (name, reason), value in sorted(
+                self.counters.items(), key=lambda item: (item[0][0], item[0][1] or "")
+            ):
+                by_reason.setdefault(name, {})[reason] = value
+            counters: Dict = {}
+            for name, reasons in by_reason.items():
+                if list(reasons) == [None]:
+                    counters[name] = reasons[None]
+                else:
+                    # A counter also recorded without a reason keeps it apart
+                    counters[name] = {
+                        reason or "unspecified": value for reason, value in reasons.items()
+                    }
+            spans = {
+                name: {**span, "avg": span["total"] / span["count"]}
+                for name, span in sorted(self.spans.items())
+            }
+
+        downloaded = counters.get("bytes_downloaded", 0)
+        download_time = spans.get("download", {}).get("total", 0)
+        return {
+            "started": self.started,
+            "elapsed": elapsed,
+            "counters": counters,
+            "spans": spans,
+            "throughput": {
+                "requests_per_second": counters.get("requests", 0) / elapsed if elapsed else 0,
+                "bytes_per_second": downloaded / elapsed if elapsed else 0,
+                # Spans overlap with concurrent downloads, this is per worker
+                "bytes_per_download_second": downloaded / download_time if download_time else 0,
+            },
+        }
+
+    def write_json(self, filepath: str) -> None:
+        with open(filepath, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=4)
+
+    def write_prometheus(self, filepath: str, labels: Optional[Dict[str, str]] = None) -> None:
+        """
+        Write the metrics in the Prometheus text format
+
+        The file is written aside and renamed, as the node_exporter textfile
+        collector expects.
+
+        Args:
+            filepath: Path of the ".prom" file
+            labels: Labels added to every sample (platform, event)
+        """
+        summary = self.summary()
+        lines = []
+
+        def sample(name, value, extra=None):
+            all_labels = {**(labels or {}), **(extra or {})}
+            label_text = ",".join(
+                f'{key}="{_escape_label(label)}"' for key, label in all_labels.items()
+            )
+            if label_text:
+                name = f"{name}{{{label_text}}}"
+            lines.append(f"{name} {value}")
+
+        for name, value in summary["counters"].items():
+            metric = f"{PROMETHEUS_PREFIX}_{_metric_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            if isinstance(value, dict):
+                for reason, count in value.items():
+                    sample(metric, count, {"reason": reason})
+            else:
+                sample(metric, value)
+
+        if summary["spans"]:
+            for suffix, kind, field in (
+                ("seconds_total", "counter", "total"),
+                ("count_total", "counter", "count"),
+                ("seconds_max", "gauge", "max"),
+            ):
+                metric = f"{PROMETHEUS_PREFIX}_span_{suffix}"
+                lines.append(f"# TYPE {metric} {kind}")
+                for name, span in summary["spans"].items():
+                    sample(metric, span[field], {"span": name})
+
+        for name, value in (
+            ("run_started_seconds", summary["started"]),
+            ("run_duration_seconds", summary["elapsed"]),
+        ):
+            metric = f"{PROMETHEUS_PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            sample(metric, value)
+
+        tmp_path = filepath + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, filepath)
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
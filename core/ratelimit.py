@@ -0,0 +1,84 @@
+import random
+import threading
+import time
+from collections import defaultdict
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+# Never sleep longer than this on a single Retry-After
+MAX_RETRY_AFTER = 300
+
+
+class RateLimiter:
+    """Token bucket per host.
+
+    Every request takes a token, buckets refill at ``rate`` tokens per second
+    up to ``burst``. A host can also be blocked for a while (after a 429), all
+    the threads sending to it wait until the block is over.
+    """
+
+    def __init__(self, rate: float = 0, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, float] = defaultdict(lambda: float(self.burst))
+        self._updated: Dict[str, float] = defaultdict(time.monotonic)
+        self._blocked_until: Dict[str, float] = defaultdict(float)
+
+    def acquire(self, host: str) -> None:
+        """Block until a request to host is allowed"""
+        while True:
+            with self._lock:
+                delay = self._take(host, time.monotonic())
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def block(self, host: str, delay: float) -> None:
+        """Hold every request to host for delay seconds"""
+        with self._lock:
+            until = time.monotonic() + delay
+            self._blocked_until[host] = max(self._blocked_until[host], until)
+
+    def _take(self, host: str, now: float) -> float:
+        """Take a token, return the time to wait if none is available"""
+        if now < self._blocked_until[host]:
+            return self._blocked_until[host] - now
+        if self.rate <= 0:
+            return 0
+
+        elapsed = now - self._updated[host]
+        self._tokens[host] = min(self.burst, self._tokens[host] + elapsed * self.rate)
+        self._updated[host] = now
+        if self._tokens[host] >= 1:
+            self._tokens[host] -= 1
+            return 0
+        return (1 - self._tokens[host]) / self.rate
+
+
+def get_retry_delay(retry_after: Optional[str], attempt: int, backoff: float) -> float:
+    """
+    Time to wait before retrying a throttled request
+
+    Args:
+        retry_after: Value of the "Retry-After" header, in seconds or as a date
+        attempt: Number of retries already done
+        backoff: Base of the exponential backoff, in seconds
+
+    Returns:
+        The Retry-After delay if the server sent one, otherwise an exponential
+        backoff with jitter so throttled threads don't retry all at once
+    """
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0), MAX_RETRY_AFTER)
+
+    delay = max(backoff, 0.1) * 2**attempt
+    return random.uniform(delay / 2, delay)
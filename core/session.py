@@ -0,0 +1,170 @@
+import logging
+import socket
+import ssl
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import urllib3
+from cloudscraper import CipherSuiteAdapter, create_scraper
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+from core.ratelimit import RateLimiter, get_retry_delay
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_TIMEOUT = 30
+# Statuses worth another try, throttling (429 or 503 with "Retry-After") is
+# handled by the rate limiter and a bare 503 is left to cloudscraper
+RETRY_STATUSES = (500, 502, 504)
+# Probe idle keep-alive connections so dead ones are noticed
+KEEPALIVE_OPTIONS = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+
+class _PoolMixin:
+    """Default timeout, TCP keep-alive and rate limiting for an adapter"""
+
+    def __init__(self, *args, timeout=None, limiter=None, backoff=DEFAULT_BACKOFF, **kwargs):
+        self.timeout = timeout
+        self.limiter = limiter or RateLimiter()
+        self.backoff = backoff
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault(
+            "socket_options", HTTPConnection.default_socket_options + KEEPALIVE_OPTIONS
+        )
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        """Send the request once its host has a token, retry it while throttled"""
+        host = urlparse(request.url).netloc
+        timeout = self.timeout if timeout is None else timeout
+        attempt = 0
+        while True:
+            self.limiter.acquire(host)
+            response = super().send(request, timeout=timeout, **kwargs)
+            if not self._is_throttled(response) or attempt >= self.max_retries.total:
+                # Throttled attempts never reach the response hooks
+                response.throttled = attempt
+                return response
+
+            delay = get_retry_delay(response.headers.get("Retry-After"), attempt, self.backoff)
+            attempt += 1
+            logger.warning(
+                f"{host} is throttling requests, retrying in {delay:.1f}s ({attempt}/{self.max_retries.total})"
+            )
+            response.close()
+            # Every thread talking to this host waits, not only this one
+            self.limiter.block(host, delay)
+
+    @staticmethod
+    def _is_throttled(response) -> bool:
+        if response.status_code == 429:
+            return True
+        return response.status_code == 503 and "Retry-After" in response.headers
+
+
+class PoolAdapter(_PoolMixin, HTTPAdapter):
+    pass
+
+
+class CipherSuitePoolAdapter(_PoolMixin, CipherSuiteAdapter):
+    pass
+
+
+def create_session(
+    pool_size: int = DEFAULT_POOL_SIZE,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    timeout: Optional[Union[float, Tuple[float, float]]] = DEFAULT_TIMEOUT,
+    verify: bool = True,
+    rps: float = 0,
+    shared_adapters: Optional[Dict[bool, Dict[str, HTTPAdapter]]] = None,
+):
+    """
+    Create the cloudscraper session shared by a platform and its downloads
+
+    Args:
+        pool_size: Connections kept open per host, should cover every thread
+            using the session
+        retries: Retries of failed connections and 5xx responses
+        backoff: Exponential backoff factor between retries, in seconds
+        timeout: Default connect/read timeout of a request, None to wait forever
+        verify: Verify TLS certificates
+        rps: Max requests per second to a single host, 0 for no limit
+        shared_adapters: Adapters by TLS verification mode, shared between
+            sessions (one per event of a batch) so they use the same
+            connection pool and rate limiter. Filled by the first session
+
+    Returns:
+        Configured CloudScraper session
+    """
+    ssl_context = None
+    if not verify:
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    session = create_scraper(ssl_context=ssl_context)
+    session.verify = verify
+
+    adapters = shared_adapters.get(verify) if shared_adapters is not None else None
+    if adapters is None:
+        adapters = create_adapters(session, pool_size, retries, backoff, timeout, rps)
+        if shared_adapters is not None:
+            adapters = shared_adapters.setdefault(verify, adapters)
+
+    for prefix, adapter in adapters.items():
+        session.mount(prefix, adapter)
+    return session
+
+
+def create_adapters(
+    session,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    timeout: Optional[Union[float, Tuple[float, float]]] = DEFAULT_TIMEOUT,
+    rps: float = 0,
+) -> Dict[str, HTTPAdapter]:
+    """
+    Create the pooled, rate limited adapters of a session
+
+    Returns:
+        Adapters by URL prefix, the HTTPS one uses the TLS settings of session
+    """
+    max_retries = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUSES,
+        raise_on_status=False,
+        # Retry-After pauses the whole host in the rate limiter instead
+        respect_retry_after_header=False,
+    )
+    pool = {
+        "pool_connections": pool_size,
+        "pool_maxsize": pool_size,
+        "max_retries": max_retries,
+        "timeout": timeout,
+        # One limiter for both schemes, buckets are per host
+        "limiter": RateLimiter(rps),
+        "backoff": backoff,
+    }
+    return {
+        # Same TLS settings as the adapter mounted by cloudscraper
+        "https://": CipherSuitePoolAdapter(
+            cipherSuite=session.cipherSuite,
+            ecdhCurve=session.ecdhCurve,
+            server_hostname=session.server_hostname,
+            source_address=session.source_address,
+            ssl_context=session.ssl_context,
+            **pool,
+        ),
+        "http://": PoolAdapter(**pool),
+    }
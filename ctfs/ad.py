@@ -1,15 +1,12 @@
 import codecs
 import json
-import logging
 import os
-import ssl
 from getpass import getpass
 from os import path
-from typing import Any, Generator, List
+from typing import Any, Generator
 from urllib.parse import urljoin, urlparse
 
-from cloudscraper import create_scraper
-
+from core import NotLoggedInException
 from core.challange import Challenge
 from ctfs.ctf import CTF
 from ctfs.ctfd import BadUserNameOrPasswordException
@@ -20,18 +17,11 @@ class NotCompatiblePlatformException(Exception):
 
 
 class AD(CTF):
-    def __init__(self, url, max_size=100, force=False):
-        if self.__class__.__name__ == "CTF":
-            raise NotCompatiblePlatformException()
-
-        self.name = self.__class__.__name__
-        self.url = url
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        self.session = create_scraper(ssl_context=ssl_context)
-        self.logger = logging.getLogger(__name__)
-        self.challanges: List[Challenge] = []
+    # Attack-defense platforms usually run on self-signed certificates
+    VERIFY_TLS = False
+
+    def __init__(self, url, max_size=100, force=False, **kwargs):
+        super().__init__(url, max_size, force, **kwargs)
 
     @staticmethod
     def apply_argparser(argument_parser) -> None:
@@ -39,18 +29,22 @@ class AD(CTF):
         argument_parser.add_argument("-p", "--password", help="password")
         argument_parser.usage += "[-u USERNAME] [-p PASSWORD] "
 
-    def __iter_challenges(self):
-        res_json = self.session.get(urljoin(self.url, "/api/challenge")).json()
+    async def __iter_challenges(self):
+        res = await self.client.get(urljoin(self.url, "/api/challenge"))
+        if res.status_code in (401, 403):
+            raise NotLoggedInException()
+        res_json = res.json()
         return res_json["data"]
 
-    def iter_challenges(self):
-        for challenge in self.__iter_challenges():
+    async def aiter_challenges(self):
+        for challenge in await self.__iter_challenges():
             yield Challenge(
                 ctf=self,
                 name=challenge["name"],
                 category="Attack Defense",
                 description=challenge["description"],
                 files=[challenge["attachment"]],
+                challenge_id=challenge.get("id"),
             )
 
     def login(self, sys_args, no_login=False, **kwargs) -> None:
@@ -1,13 +1,27 @@
 import codecs
 import json
 import logging
+import asyncio
+import os
+import sqlite3
+import time
 from os import path
-from typing import Any, Generator, List
+from typing import Any, AsyncGenerator, Generator, List
 from urllib.parse import urljoin
 
-from cloudscraper import create_scraper
-
+from core import helper
 from core.challange import Challenge
+from core.client import AsyncClient, iter_sync
+from core.index import ArchiveIndex
+from core.journal import Journal
+from core.metrics import Metrics
+from core.session import (
+    DEFAULT_BACKOFF,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+    create_session,
+)
 from downloader import DownloadManager
 
 
@@ -15,25 +29,124 @@ class NotCompatiblePlatformException(Exception):
     pass
 
 
+class EventLoggerAdapter(logging.LoggerAdapter):
+    def process(self, msg, kwargs):
+        return f"[{self.extra['event']}] {msg}", kwargs
+
+
 class CTF(object):
-    def __init__(self, url, max_size=100, force=False):
+    VERIFY_TLS = True
+
+    def __init__(
+        self,
+        url,
+        max_size=100,
+        force=False,
+        jobs=1,
+        download_jobs=1,
+        per_host=0,
+        segments=1,
+        store=None,
+        max_extract_bytes=0,
+        max_extract_ratio=0,
+        extract_jobs=0,
+        extract_depth=1,
+        chunk_size=DownloadManager.MAX_CHUNK_SIZE,
+        pool_size=0,
+        retries=DEFAULT_RETRIES,
+        backoff=DEFAULT_BACKOFF,
+        timeout=DEFAULT_TIMEOUT,
+        rps=0,
+        output_dir="",
+        shared=None,
+        index=None,
+    ):
         if self.__class__.__name__ == "CTF":
             raise NotCompatiblePlatformException()
 
         self.name = self.__class__.__name__
         self.url = url
-        self.session = create_scraper()
+        self.jobs = max(1, jobs)
+        # challenges.json, session.json and the challenge directories live
+        # here, "" is the working directory
+        self.output_dir = output_dir
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        # Enumeration threads, download workers and their segments all share
+        # the connection pool of this session
+        if not pool_size:
+            pool_size = max(DEFAULT_POOL_SIZE, self.jobs + download_jobs * max(1, segments))
+        self.session = create_session(
+            pool_size,
+            retries,
+            backoff,
+            timeout or None,
+            verify=self.VERIFY_TLS,
+            rps=rps,
+            shared_adapters=shared.adapters if shared else None,
+        )
+        self.metrics = Metrics()
+        self.session.hooks["response"].append(self.metrics.on_response)
+        self.client = AsyncClient(self.session, self.jobs)
         self.logger = logging.getLogger(__name__)
+        if output_dir:
+            # Tell the events of a batch apart in the log
+            self.logger = EventLoggerAdapter(self.logger, {"event": output_dir})
         self.challanges: List[Challenge] = []
 
-        DownloadManager.init(self.session, self.logger, force, max_size)
+        self.downloader = DownloadManager(
+            self.session,
+            self.logger,
+            force,
+            max_size,
+            download_jobs,
+            per_host,
+            segments,
+            store,
+            max_extract_bytes,
+            max_extract_ratio,
+            extract_jobs,
+            extract_depth,
+            chunk_size,
+            root=output_dir,
+            scheduler=shared.scheduler if shared else None,
+            extract_pool=shared.extract_pool if shared else None,
+            store=shared.store if shared else None,
+            on_record=self.__journal_file,
+            metrics=self.metrics,
+        )
+        # Progress of the current run, compacted into challenges.json when it
+        # ends and replayed by the next run if it doesn't
+        self.journal = Journal(
+            self.get_path("challenges.journal"),
+            header={"type": "run", "platform": self.name, "url": self.url},
+        )
+        self.index = ArchiveIndex(index) if index else None
 
     @staticmethod
     def apply_argparser(argument_parser) -> None:
         raise NotImplementedError()
 
-    def iter_challenges(self) -> Generator[Challenge, Any, None]:
+    async def aiter_challenges(self) -> AsyncGenerator[Challenge, None]:
         raise NotImplementedError()
+        yield
+
+    def iter_challenges(self) -> Generator[Challenge, Any, None]:
+        # Synchronous view of aiter_challenges, used by save() and update().
+        # Only the time spent waiting for the platform counts as enumeration
+        challenges = iter_sync(self.aiter_challenges())
+        waited = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                challenge = next(challenges, None)
+                waited += time.perf_counter() - started
+                if challenge is None:
+                    return
+                self.metrics.incr("challenges")
+                yield challenge
+        finally:
+            self.metrics.observe("enumeration", waited)
 
     def login(self, no_login=False, **kwargs) -> None:
         raise NotImplementedError()
@@ -44,14 +157,180 @@ class CTF(object):
     def credential_from_dict(self, credential) -> None:
         raise NotImplementedError()
 
+    def session_to_dict(self):
+        # Platform state worth keeping with the session (tokens, version)
+        return {}
+
+    def session_from_dict(self, state) -> None:
+        pass
+
+    async def map_concurrent(self, func, items):
+        # Await the coroutine func on every item, up to `self.jobs` at once
+        # on the shared client, results are yielded in the input order
+        semaphore = asyncio.Semaphore(self.jobs)
+
+        async def run(item):
+            async with semaphore:
+                return await func(item)
+
+        tasks = [asyncio.ensure_future(run(item)) for item in items]
+        try:
+            for task in tasks:
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
     def logout(self):
         self.session.get(urljoin(self.url, "/logout"))
 
+    def get_path(self, *parts):
+        return path.join(self.output_dir, *parts)
+
+    def report_metrics(self, json_path=None, prometheus_path=None):
+        metrics = self.metrics
+        skipped = metrics.get("files_skipped")
+        self.logger.info(
+            f"Finished in {time.time() - metrics.started:.1f}s: "
+            f"{metrics.get('requests'):.0f} requests ({metrics.get('retries'):.0f} retries), "
+            f"{metrics.get('files_downloaded'):.0f} files downloaded "
+            f"({helper.size_converter(int(metrics.get('bytes_downloaded')))}), "
+            f"{skipped:.0f} skipped, {metrics.get('files_failed'):.0f} failed"
+        )
+        # Relative paths land in the output directory, one file per event
+        if json_path:
+            metrics.write_json(self.get_path(json_path))
+        if prometheus_path:
+            labels = {"platform": self.name, "url": self.url}
+            if self.output_dir:
+                labels["event"] = self.output_dir
+            metrics.write_prometheus(self.get_path(prometheus_path), labels)
+
+    def close(self):
+        # Also called after a failed run, every handle is released
+        try:
+            self.downloader.close()
+        finally:
+            try:
+                self.client.close()
+            finally:
+                self.journal.close()
+
+    def save_session(self, ttl):
+        # Cookies and bearer token of the logged in session, so the next run
+        # can skip the login. Expires with the first session cookie
+        expires = time.time() + ttl
+        cookies = []
+        for cookie in self.session.cookies:
+            if cookie.expires:
+                expires = min(expires, cookie.expires)
+            cookies.append(
+                {
+                    "name": cookie.name,
+                    "value": cookie.value,
+                    "domain": cookie.domain,
+                    "path": cookie.path,
+                    "expires": cookie.expires,
+                    "secure": cookie.secure,
+                }
+            )
+
+        session = {
+            "platform": self.name,
+            "url": self.url,
+            "expires": expires,
+            "cookies": cookies,
+            "authorization": self.session.headers.get("Authorization"),
+            "credentials": self.credential_to_dict(),
+            "state": self.session_to_dict(),
+        }
+        # Only readable by the owner, it holds live credentials
+        fd = os.open(
+            self.get_path("session.json"), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+        )
+        with open(fd, "w", encoding="utf-8") as f:
+            f.write(json.dumps(session, indent=4))
+
+    def load_session(self) -> bool:
+        if not path.exists(self.get_path("session.json")):
+            return False
+
+        with codecs.open(self.get_path("session.json"), "r", encoding="utf-8") as f:
+            session = json.load(f)
+
+        if session["platform"] != self.name or session["url"] != self.url:
+            return False
+        if session["expires"] <= time.time():
+            return False
+
+        for cookie in session["cookies"]:
+            self.session.cookies.set(**cookie)
+        if session["authorization"]:
+            self.session.headers["Authorization"] = session["authorization"]
+        self.credential_from_dict(session["credentials"])
+        self.session_from_dict(session["state"])
+        return True
+
+    def clear_session(self):
+        self.session.cookies.clear()
+        self.session.headers.pop("Authorization", None)
+        if path.exists(self.get_path("session.json")):
+            os.remove(self.get_path("session.json"))
+
+    def __journal_challenge(self, challenge):
+        self.journal.append({"type": "challenge", "challenge": challenge.to_dict()})
+
+    def __journal_file(self, key, validators):
+        self.journal.append({"type": "file", "path": key, "validators": validators})
+
+    def __replay_journal(self):
+        # Apply the records of an interrupted run on top of the loaded config
+        records = self.journal.read()
+        if not records:
+            return False
+
+        header = records[0]
+        if header.get("platform") != self.name or header.get("url") != self.url:
+            raise NotCompatiblePlatformException()
+
+        by_id = {
+            challenge.challenge_id: index
+            for index, challenge in enumerate(self.challanges)
+            if challenge.challenge_id is not None
+        }
+        by_key = {challenge.key: index for index, challenge in enumerate(self.challanges)}
+        challenges = files = 0
+        for record in records[1:]:
+            if record["type"] == "file":
+                self.downloader.file_validators[record["path"]] = record["validators"]
+                files += 1
+                continue
+
+            challenge = Challenge.from_dict(record["challenge"], self)
+            index = by_id.get(challenge.challenge_id, by_key.get(challenge.key))
+            if index is None:
+                index = len(self.challanges)
+                self.challanges.append(challenge)
+            else:
+                self.challanges[index] = challenge
+            if challenge.challenge_id is not None:
+                by_id[challenge.challenge_id] = index
+            by_key[challenge.key] = index
+            challenges += 1
+
+        self.logger.info(
+            f"Recovered {challenges} challenges and {files} files from an interrupted run"
+        )
+        return True
+
     def save_config(self):
         if self.name == "CTF":
             raise NotCompatiblePlatformException()
 
-        with codecs.open("challenges.json", "w", encoding="utf-8") as f:
+        # Written aside and renamed, a crash never leaves a torn config
+        config_path = self.get_path("challenges.json")
+        tmp_path = config_path + ".tmp"
+        with codecs.open(tmp_path, "w", encoding="utf-8") as f:
             f.write(
                 json.dumps(
                     {
@@ -61,52 +340,130 @@ class CTF(object):
                         "challenges": [
                             challenge.to_dict() for challenge in self.challanges
                         ],
+                        "files": self.downloader.file_validators,
                     },
                     indent=4,
                 )
             )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, config_path)
+        self.journal.remove()
+
+    def update_index(self):
+        if self.index is None:
+            return
+
+        try:
+            with self.metrics.span("index"):
+                self.index.add_event(self)
+        except sqlite3.Error as e:
+            # The dump itself is complete, the next run indexes it again
+            self.logger.error(f"Failed to index {self.index.filepath}: {e}")
 
     def load_config(self) -> bool:
-        if not path.exists("challenges.json"):
-            return False
+        has_config = path.exists(self.get_path("challenges.json"))
+        if has_config:
+            with codecs.open(self.get_path("challenges.json"), "r", encoding="utf-8") as f:
+                config = json.load(f)
+                if config["platform"] != self.name or config["url"] != self.url:
+                    raise NotCompatiblePlatformException()
 
-        with codecs.open("challenges.json", "r", encoding="utf-8") as f:
-            config = json.load(f)
-            if config["platform"] != self.name or config["url"] != self.url:
-                raise NotCompatiblePlatformException()
+                self.credential_from_dict(config["credentials"])
 
-            self.credential_from_dict(config["credentials"])
+                for challenge in config["challenges"]:
+                    self.challanges.append(Challenge.from_dict(challenge, self))
 
-            for challenge in config["challenges"]:
-                self.challanges.append(Challenge.from_dict(challenge, self))
+                self.downloader.file_validators = config.get("files", {})
 
-        return True
+        if self.__replay_journal():
+            # Compact right away, the journal of this run starts empty
+            self.save_config()
+            has_config = True
+
+        return has_config
 
     def save(self):
-        self.challanges = list(self.iter_challenges())
-        for challenge in self.challanges:
+        # Challenges are dumped and their files queued as soon as they are
+        # enumerated, the downloads run while the enumeration goes on
+        self.challanges = []
+        for challenge in self.iter_challenges():
             self.logger.info(
                 f"Creating Challenge [{challenge.category or 'No Category'}] {challenge.name}"
             )
             challenge.dump()
+            self.__journal_challenge(challenge)
             challenge.download_all_files()
+            self.challanges.append(challenge)
 
+        with self.metrics.span("downloads_wait"):
+            self.downloader.wait()
         self.save_config()
+        self.update_index()
+
+    def __match_challenge(self, challenge, by_id, by_key):
+        if challenge.challenge_id is not None:
+            old_challenge = by_id.pop(challenge.challenge_id, None)
+            if old_challenge is not None:
+                by_key.pop(old_challenge.key, None)
+                return old_challenge
+
+        # Configs written before ids were saved only match by category and name
+        old_challenge = by_key.pop(challenge.key, None)
+        if old_challenge is not None and old_challenge.challenge_id is not None:
+            by_id.pop(old_challenge.challenge_id, None)
+        return old_challenge
 
     def update(self, force=False):
-        new_challange = list(self.iter_challenges())
+        manager = self.downloader
+        file_validators = dict(manager.file_validators)
+        by_id = {
+            challenge.challenge_id: challenge
+            for challenge in self.challanges
+            if challenge.challenge_id is not None
+        }
+        by_key = {challenge.key: challenge for challenge in self.challanges}
+
+        new_challange = []
         is_changed = False
-        for nc, oc in zip(new_challange, self.challanges):
-            if nc != oc:
+        for nc in self.iter_challenges():
+            new_challange.append(nc)
+            oc = self.__match_challenge(nc, by_id, by_key)
+            if oc is None:
+                self.logger.info(
+                    f"Creating Challenge [{nc.category or 'No Category'}] {nc.name}"
+                )
+                nc.dump()
+                is_changed = True
+            elif nc != oc:
                 self.logger.info(
                     f"Updating Challenge [{nc.category or 'No Category'}] {nc.name}"
                 )
                 nc.dump()
-                nc.download_all_files()
                 is_changed = True
 
+            if oc is None or nc != oc:
+                self.__journal_challenge(nc)
+
+            # Unchanged challenges still revalidate their files, which costs
+            # a conditional request (usually a 304) per file
+            nc.download_all_files()
+
+        # Files of removed challenges are kept on disk
+        for oc in by_key.values():
+            self.logger.info(
+                f"Removed Challenge [{oc.category or 'No Category'}] {oc.name}"
+            )
+            is_changed = True
+
+        with self.metrics.span("downloads_wait"):
+            manager.wait()
         if is_changed:
             self.challanges = new_challange
+
+        if is_changed or manager.file_validators != file_validators:
             self.save_config()
         else:
+            self.journal.remove()
             self.logger.info("No changes found")
+        self.update_index()
@@ -14,10 +14,12 @@ class BadUserNameOrPasswordException(Exception):
 
 
 class CTFd(CTF):
-    def __init__(self, url, max_size=100, force=False):
-        super().__init__(url, max_size, force)
+    def __init__(self, url, max_size=100, force=False, **kwargs):
+        super().__init__(url, max_size, force, **kwargs)
         self.username = ""
         self.password = ""
+        self.__version = None
+        self.__listing = None
 
     @staticmethod
     def apply_argparser(argument_parser):
@@ -25,28 +27,39 @@ class CTFd(CTF):
         argument_parser.add_argument("-p", "--password", help="password")
         argument_parser.usage += "[-u USERNAME] [-p PASSWORD] "
 
-    @property
-    def version(self):
+    async def get_version(self):
+        # Probed once per run, the probe response is the challenge list and is
+        # kept for __iter_challenges
+        if self.__version is None:
+            with self.metrics.span("version_probe"):
+                version, listing = await self.__probe_version()
+            if version < 0:
+                return version
+            self.__version, self.__listing = version, listing
+        return self.__version
+
+    async def __probe_version(self):
         # CTFd >= v2
-        res = self.session.get(urljoin(self.url, "/api/v1/challenges"))
+        res = await self.client.get(urljoin(self.url, "/api/v1/challenges"))
         if res.status_code == 403:
             # Unknown (Not logged In)
-            return -1
+            return -1, None
 
         if res.status_code != 404:
-            return 2
+            return 2, res.json()
 
         # CTFd  >= v1.2
-        res = self.session.get(urljoin(self.url, "/chals"))
+        res = await self.client.get(urljoin(self.url, "/chals"))
         if res.status_code == 403:
             # Unknown (Not logged In)
-            return -1
+            return -1, None
 
-        if "description" not in res.json()["game"][0]:
-            return 1
+        res_json = res.json()
+        if "description" not in res_json["game"][0]:
+            return 1, res_json
 
         # CTFd  <= v1.1
-        return 0
+        return 0, res_json
 
     def __get_nonce(self):
         res = self.session.get(urljoin(self.url, "/login"))
@@ -75,47 +88,98 @@ class CTFd(CTF):
 
         self.username = username
         self.password = password
+        # Logged in users may see another challenge list
+        self.__version = None
+        self.__listing = None
 
     def __get_file_url(self, file_name):
         if not file_name.startswith("/files/"):
             file_name = f"/files/{file_name}"
         return urljoin(self.url, file_name)
 
-    def __iter_challenges(self):
-        version = self.version
+    async def __get_challenge_v2(self, challenge):
+        res = await self.client.get(
+            urljoin(self.url, f"/api/v1/challenges/{challenge['id']}")
+        )
+        return res.json()["data"]
+
+    async def __get_challenge_v1(self, challenge):
+        res = await self.client.get(urljoin(self.url, f"/chals/{challenge['id']}"))
+        return res.json()
+
+    async def __get_page(self, path, params, page):
+        res = await self.client.get(urljoin(self.url, path), params={**params, "page": page})
+        return res.json()
+
+    async def __get_paginated(self, path, res_json, params=None):
+        # Follow meta.pagination of the list endpoints that are paginated, all
+        # the remaining pages are requested at once when their count is known
+        params = params or {}
+        data = list(res_json["data"])
+        pagination = (res_json.get("meta") or {}).get("pagination") or {}
+        if pagination.get("next") and pagination.get("pages"):
+            pages = range(pagination["next"], pagination["pages"] + 1)
+            async for page_json in self.map_concurrent(
+                lambda page: self.__get_page(path, params, page), pages
+            ):
+                data += page_json["data"]
+            return data
+
+        while pagination.get("next"):
+            res_json = await self.__get_page(path, params, pagination["next"])
+            data += res_json["data"]
+            pagination = (res_json.get("meta") or {}).get("pagination") or {}
+        return data
+
+    async def __iter_challenges(self):
+        version = await self.get_version()
         if version < 0:
             raise NotLoggedInException()
 
+        listing, self.__listing = self.__listing, None
+        if listing is None:
+            # Version restored from a saved session (or listing already
+            # consumed), only the list itself is needed
+            path = "/api/v1/challenges" if version >= 2 else "/chals"
+            res = await self.client.get(urljoin(self.url, path))
+            if res.status_code in (401, 403):
+                raise NotLoggedInException()
+            try:
+                listing = res.json()
+            except ValueError:
+                # Redirected to the login page
+                raise NotLoggedInException()
+
         if version >= 2:
-            res_json = self.session.get(urljoin(self.url, "/api/v1/challenges")).json()
-            challenges = res_json["data"]
-            for challenge in challenges:
-                challenge_json = self.session.get(
-                    urljoin(self.url, f"/api/v1/challenges/{challenge['id']}")
-                ).json()
-                yield challenge_json["data"]
+            challenges = await self.__get_paginated("/api/v1/challenges", listing)
+            # The list has no descriptions nor files, and CTFd has no endpoint
+            # returning them in bulk: one detail request per challenge
+            async for challenge in self.map_concurrent(
+                self.__get_challenge_v2, challenges
+            ):
+                yield challenge
+            return
 
+        challenges = listing["game"]
+        if version >= 1:
+            async for challenge in self.map_concurrent(
+                self.__get_challenge_v1, challenges
+            ):
+                yield challenge
             return
 
-        res_json = self.session.get(urljoin(self.url, "/chals")).json()
-        challenges = res_json["game"]
         for challenge in challenges:
-            if version >= 1:
-                yield self.session.get(
-                    urljoin(self.url, f"/chals/{challenge['id']}")
-                ).json()
-                continue
-
             yield challenge
 
-    def iter_challenges(self):
-        for challenge in self.__iter_challenges():
+    async def aiter_challenges(self):
+        async for challenge in self.__iter_challenges():
             yield Challenge(
                 ctf=self,
                 name=challenge["name"],
                 category=challenge["category"],
                 description=challenge["description"],
                 files=list(map(self.__get_file_url, challenge.get("files", []))),
+                challenge_id=challenge.get("id"),
             )
 
     def credential_to_dict(self):
@@ -127,3 +191,9 @@ class CTFd(CTF):
     def credential_from_dict(self, credential):
         self.username = credential["username"]
         self.password = credential["password"]
+
+    def session_to_dict(self):
+        return {"version": self.__version}
+
+    def session_from_dict(self, state):
+        self.__version = state.get("version")
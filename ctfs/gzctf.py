@@ -14,8 +14,8 @@ class BadUserNameOrPasswordException(Exception):
 
 
 class GZctf(CTF):
-    def __init__(self, url, max_size=100, force=False):
-        super().__init__(url, max_size, force)
+    def __init__(self, url, max_size=100, force=False, **kwargs):
+        super().__init__(url, max_size, force, **kwargs)
         self.username = ""
         self.password = ""
         self.game_id = None
@@ -58,30 +58,38 @@ class GZctf(CTF):
             file_name = f"/files/{file_name}"
         return urljoin(self.url, file_name)
 
-    def __get_details_challenge(self, challenge_id):
-        return self.session.get(
+    async def __get_details_challenge(self, challenge_id):
+        res = await self.client.get(
             urljoin(self.url, f"/api/game/{self.game_id}/challenges/{challenge_id}")
-        ).json()
+        )
+        return res.json()
 
-    def iter_challenges(self):
-        details = self.session.get(
-            urljoin(self.url, f"/api/game/{self.game_id}/details")
-        ).json()
+    async def aiter_challenges(self):
+        res = await self.client.get(urljoin(self.url, f"/api/game/{self.game_id}/details"))
+        if res.status_code in (401, 403):
+            raise NotLoggedInException()
+        details = res.json()
         challenges = details["challenges"]
-        for category in challenges.keys():
-            for challenge in challenges[category]:
-                challenge = self.__get_details_challenge(challenge["id"])
-                yield Challenge(
-                    ctf=self,
-                    name=challenge["title"],
-                    category=challenge["tag"],
-                    description=challenge["content"],
-                    files=(
-                        [self.url + challenge["context"]["url"].strip("/")]
-                        if challenge["context"]["url"]
-                        else []
-                    ),
-                )
+        challenge_ids = [
+            challenge["id"]
+            for category in challenges.keys()
+            for challenge in challenges[category]
+        ]
+        async for challenge in self.map_concurrent(
+            self.__get_details_challenge, challenge_ids
+        ):
+            yield Challenge(
+                ctf=self,
+                name=challenge["title"],
+                category=challenge["tag"],
+                description=challenge["content"],
+                files=(
+                    [self.url + challenge["context"]["url"].strip("/")]
+                    if challenge["context"]["url"]
+                    else []
+                ),
+                challenge_id=challenge.get("id"),
+            )
 
     def credential_to_dict(self):
         return {
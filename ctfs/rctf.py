@@ -1,6 +1,7 @@
 import json
 from urllib.parse import unquote, urljoin
 
+from core import NotLoggedInException
 from core.challange import Challenge
 from ctfs.ctf import CTF
 
@@ -10,8 +11,8 @@ class BadTokenException(Exception):
 
 
 class rCTF(CTF):
-    def __init__(self, url, max_size=100, force=False):
-        super().__init__(url, max_size, force)
+    def __init__(self, url, max_size=100, force=False, **kwargs):
+        super().__init__(url, max_size, force, **kwargs)
         self.BarerToken = ""
         self.team_token = ""
 
@@ -48,21 +49,22 @@ class rCTF(CTF):
         self.BarerToken = json.loads(res.content)["data"]["authToken"]
         self.team_token = team_token
 
-    def __iter_challenges(self):
+    async def __iter_challenges(self):
         headers = {
             "Content-type": "application/json",
             "Accept": "application/json",
             "Authorization": "Bearer {}".format(self.BarerToken),
         }
-        res_json = self.session.get(
-            urljoin(self.url, "/api/v1/challs"), headers=headers
-        ).json()
+        res = await self.client.get(urljoin(self.url, "/api/v1/challs"), headers=headers)
+        if res.status_code in (401, 403):
+            raise NotLoggedInException()
+        res_json = res.json()
         challenges = res_json["data"]
         for challenge in challenges:
             yield challenge
 
-    def iter_challenges(self):
-        for challenge in self.__iter_challenges():
+    async def aiter_challenges(self):
+        async for challenge in self.__iter_challenges():
             yield Challenge(
                 ctf=self,
                 name=challenge["name"],
@@ -70,6 +72,7 @@ class rCTF(CTF):
                 description=challenge["description"],
                 value=challenge["points"],
                 files=list(map(self.__get_file_url, challenge.get("files", []))),
+                challenge_id=challenge.get("id"),
             )
 
     def credential_to_dict(self):
@@ -77,3 +80,9 @@ class rCTF(CTF):
 
     def credential_from_dict(self, credential):
         self.team_token = credential["team_token"]
+
+    def session_to_dict(self):
+        return {"token": self.BarerToken}
+
+    def session_from_dict(self, state):
+        self.BarerToken = state.get("token", "")
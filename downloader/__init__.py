@@ -1,20 +1,43 @@
+import json
+import multiprocessing
 import os
 import re
-import tarfile
+import threading
 import time
-import zipfile
+from contextlib import contextmanager
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from concurrent.futures import wait as wait_futures
 from http.client import IncompleteRead
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
-import py7zr
-import rarfile
 import tqdm
-from requests.exceptions import ConnectionError
+from requests.exceptions import (
+    ChunkedEncodingError,
+    ConnectionError,
+    ContentDecodingError,
+)
+from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
+from urllib3.exceptions import IncompleteRead as TruncatedBody
 
 from core import helper
+from core.metrics import Metrics
 from downloader.drive import DriveSource
+from downloader.extract import (
+    COMPRESSED_EXTENSIONS,
+    MAGIC_HEADER_SIZE,
+    extract_archive,
+    extract_archive_timed,
+    get_compression_type,
+)
 from downloader.mediafire import MediafireSource
+from downloader.scheduler import DownloadScheduler
+from downloader.store import BlobStore
 
 SOURCES: List = [DriveSource, MediafireSource]
 
@@ -26,9 +49,33 @@ class FailedToExtractFile(Exception):
     """Raised when file extraction fails"""
     pass
 
+class UnexpectedHTMLPage(FailedToDownloadFile):
+    """Raised when an HTML (error) page is served instead of a file"""
+    pass
+
+class RangeNotHonoured(FailedToDownloadFile):
+    """Raised when a segment request isn't answered with its byte range"""
+    pass
+
 class DownloadManager:
-    _instance = None
-    CHUNK_SIZE = 1024
+    # Reads start at CHUNK_SIZE and double while the link keeps up, up to
+    # the configured chunk size
+    CHUNK_SIZE = 64 * 1024
+    MAX_CHUNK_SIZE = 4 * 1024 * 1024
+    CHUNK_TARGET_TIME = 0.25
+    WRITE_BUFFER_SIZE = 1024 * 1024
+    PROGRESS_INTERVAL = 0.1
+    PART_SUFFIX = ".part"
+    JOURNAL_SUFFIX = ".part.json"
+    SEGMENT_MIN_SIZE = 4 * 1024 * 1024
+    HTML_SIGNATURES = (b"<!doctype html", b"<html")
+    # Names of pages, templates and sources that may legitimately hold HTML
+    TEXT_EXTENSIONS = (
+        ".html", ".htm", ".xhtml", ".shtml", ".txt", ".md", ".xml", ".svg",
+        ".php", ".phtml", ".jsp", ".asp", ".aspx", ".ejs", ".erb", ".twig",
+        ".j2", ".jinja", ".jinja2", ".tpl", ".tmpl", ".hbs", ".mustache",
+        ".vue", ".js", ".ts", ".py", ".rb", ".go", ".java", ".cs",
+    )
     BINARY_CONTENT_TYPES = {
         "application/octet-stream",
         "application/zip",
@@ -41,117 +88,613 @@ class DownloadManager:
         "audio/",
     }
     
-    COMPRESSED_EXTENSIONS = {
-        '.zip': 'zip',
-        '.rar': 'rar',
-        '.7z': '7z',
-        '.tar': 'tar',
-        '.tar.gz': 'tar.gz',
-        '.tgz': 'tar.gz',
-        '.tar.bz2': 'tar.bz2',
-        '.tbz2': 'tar.bz2'
-    }
+    COMPRESSED_EXTENSIONS = COMPRESSED_EXTENSIONS
 
-    def __init__(self, session, logger, is_force: bool, max_size: int):
+    def __init__(
+        self,
+        session,
+        logger,
+        is_force: bool,
+        max_size: int,
+        workers: int = 1,
+        per_host: int = 0,
+        segments: int = 1,
+        store_path: Optional[str] = None,
+        max_extract_bytes: int = 0,
+        max_extract_ratio: float = 0,
+        extract_jobs: int = 0,
+        max_extract_depth: int = 1,
+        chunk_size: int = MAX_CHUNK_SIZE,
+        *,
+        root: str = "",
+        scheduler: Optional[DownloadScheduler] = None,
+        extract_pool: Optional[ProcessPoolExecutor] = None,
+        store: Optional[BlobStore] = None,
+        on_record: Optional[Callable[[str, Dict], None]] = None,
+        metrics: Optional[Metrics] = None,
+    ):
+        """
+        Args:
+            extract_jobs: Extraction processes, 0 to extract inline. They are
+                spawned, a script passing more than 0 needs an
+                ``if __name__ == "__main__"`` guard
+            root: Output directory, file validators are keyed relative to it
+            scheduler: Scheduler shared with other managers, replaces the
+                workers/per_host pool of this manager
+            extract_pool: Extraction processes shared with other managers
+            store: File store shared with other managers, replaces store_path
+            on_record: Called with the key and validators of every completed
+                file, from the download thread
+            metrics: Receives the download and extraction counters and spans
+        """
         self.session = session
         self.logger = logger
         self.is_force = is_force
         self.max_size_bytes = max_size * 1024 * 1024
+        self.root = root
+        # Shared scheduler and pool belong to the caller, close() leaves them
+        self.owns_scheduler = scheduler is None
+        self.scheduler = scheduler or DownloadScheduler(workers, per_host)
+        self.segments = max(1, segments)
+        if store is None and store_path:
+            store = BlobStore(store_path)
+        self.store = store
+        self.max_extract_bytes = max_extract_bytes
+        self.max_extract_ratio = max_extract_ratio
+        self.extract_jobs = extract_jobs
+        self.max_extract_depth = max(1, max_extract_depth)
+        self.chunk_size = max(1, chunk_size)
+        self.owns_extract_pool = extract_pool is None
+        self.extract_pool: Optional[ProcessPoolExecutor] = extract_pool
+        self.downloads: List[Future] = []
+        self.extractions: List[Future] = []
+        # ETag, Last-Modified and length of every downloaded file, by path
+        self.file_validators: Dict[str, Dict] = {}
+        self.on_record = on_record
+        self.metrics = metrics or Metrics()
+        self._lock = threading.Lock()
+        # Downloads writing to the same path (same name in one directory)
+        # run one after the other, the first one to produce the file wins
+        self._file_locks: Dict[str, threading.RLock] = {}
+        self._handled_files = set()
 
-    @staticmethod
-    def init(session, logger, is_force: bool, max_size: int):
-        assert DownloadManager._instance is None, "DownloadManager is already initialized"
-        DownloadManager._instance = DownloadManager(session, logger, is_force, max_size)
+    def _extract_file(
+        self,
+        filepath: str,
+        extract_path: str,
+        header: Optional[bytes] = None,
+        digest: Optional[str] = None,
+    ) -> None:
+        """
+        Extract compressed file based on its extension or content
 
-    @staticmethod
-    def get_instance():
-        assert DownloadManager._instance is not None, "DownloadManager is not initialized"
-        return DownloadManager._instance
+        Members are streamed to disk one by one, paths escaping extract_path
+        and archives expanding beyond the configured size or ratio are refused.
 
-    def _extract_file(self, filepath: str, extract_path: str) -> None:
-        """
-        Extract compressed file based on its extension
-        
         Args:
             filepath: Path to compressed file
             extract_path: Directory to extract to
+            header: First bytes of the file if they were seen while downloading
+            digest: SHA-256 of the file if the store already computed it
         """
         filename = os.path.basename(filepath)
-        extension = self._get_compression_type(filepath)
+        extension = self._get_compression_type(filepath, header)
         
         if not extension:
             return
             
         try:
-            if extension == 'zip':
-                with zipfile.ZipFile(filepath, 'r') as zip_ref:
-                    zip_ref.extractall(extract_path)
-                    
-            elif extension == 'rar':
-                with rarfile.RarFile(filepath, 'r') as rar_ref:
-                    rar_ref.extractall(extract_path)
-                    
-            elif extension == '7z':
-                with py7zr.SevenZipFile(filepath, 'r') as sz_ref:
-                    sz_ref.extractall(extract_path)
-                    
-            elif 'tar' in extension:
-                with tarfile.open(filepath) as tar_ref:
-                    # Check for any harmful files before extraction
-                    for member in tar_ref.getmembers():
-                        if member.name.startswith(('/')) or '..' in member.name:
-                            raise FailedToExtractFile(f"Potentially harmful file in archive: {member.name}")
-                    tar_ref.extractall(extract_path)
-                    
-            self.logger.info(f'Successfully extracted "{filename}" to {extract_path}')
+            written = extract_archive(
+                filepath,
+                extract_path,
+                extension,
+                self.max_extract_bytes,
+                self.max_extract_ratio,
+                self.max_extract_depth,
+                digest,
+                self.is_force,
+            )
+            self._log_extracted(filename, extract_path, written)
             
         except Exception as e:
             raise FailedToExtractFile(f'Failed to extract "{filename}": {str(e)}')
 
-    def _get_compression_type(self, filepath: str) -> Optional[str]:
+    def _get_compression_type(self, filepath: str, header: Optional[bytes] = None) -> Optional[str]:
         """
-        Determine compression type based on file extension
+        Determine compression type based on file extension or magic bytes
         
         Args:
             filepath: Path to file
+            header: First bytes of the file, read from disk when missing
             
         Returns:
             String indicating compression type or None if not compressed
         """
-        for ext, comp_type in self.COMPRESSED_EXTENSIONS.items():
-            if filepath.lower().endswith(ext):
-                return comp_type
-        return None
+        return get_compression_type(filepath, header)
+
+    def download_with_progress(self, response, path: str, filename: str, total_size: Optional[int], retries: int = 3, revalidated: bool = False) -> None:
+        """
+        Stream a response into path/filename, resuming interrupted transfers
+
+        The data is written to a ".part" file next to a small journal holding
+        the validators of the response. The size of the ".part" file is the
+        number of bytes received so far, when a transfer breaks (or a previous
+        run died) it is resumed with a "Range" request if the server supports it.
+        Large files are fetched in parallel byte ranges when segments are enabled.
 
-    def download_with_progress(self, response, path: str, filename: str, total_size: Optional[int], retries: int = 3) -> None:
+        Args:
+            response: Streamed response of the file
+            path: Download directory path
+            filename: Output filename
+            total_size: Size of the file if known
+            retries: Number of attempts before giving up
+            revalidated: The response is a conditional request that returned
+                a new version of an existing file
+        """
         filepath = os.path.join(path, filename)
+        with self._claim_file(filepath, filename) as is_claimed:
+            if not is_claimed:
+                response.close()
+                return
+            self._download_with_progress(
+                response, path, filename, total_size, retries, revalidated
+            )
 
-        if self._should_skip_download(filepath, filename, total_size):
+    def _download_with_progress(self, response, path: str, filename: str, total_size: Optional[int], retries: int, revalidated: bool) -> None:
+        filepath = os.path.join(path, filename)
+        if self._should_skip_download(filepath, filename, total_size, revalidated):
+            return
+
+        url = response.url
+        part_path = filepath + self.PART_SUFFIX
+        validators = self._get_validators(response, total_size)
+        digest = self.store.fetch(validators, filepath) if self.store is not None else None
+        if digest is not None:
+            response.close()
+            self.logger.info(f'Linked "{filename}" from the file store')
+            self.metrics.incr("files_linked")
+            self._record_validators(filepath, validators)
+            self._extract_downloaded(filepath, path, digest=digest)
             return
 
         self._log_download_start(filename, total_size)
 
+        offset = 0
+        header = None
+        segments = self._get_segments(validators)
+        if segments:
+            # The segments are fetched with their own range requests
+            response.close()
+        else:
+            if self._can_resume(part_path, validators):
+                # Drop the fresh response and ask only for the missing bytes
+                self.logger.info(
+                    f'Resuming "{filename}" from {helper.size_converter(os.path.getsize(part_path))}'
+                )
+                response.close()
+                response = None
+            self._write_journal(part_path, validators)
+
         attempt = 0
+        # Set when the segments fell back to one stream, the version to
+        # download is the one of the next response
+        is_refetch = False
         while attempt < retries:
             try:
-                if total_size is None:
-                    self._download_file_without_size(response, filepath, filename)
+                if segments:
+                    self._download_file_segmented(url, part_path, filename, validators, segments)
                 else:
-                    self._download_file_with_size(response, filepath, filename, total_size)
-                
-                # After successful download, check if it's compressed and extract
-                if os.path.exists(filepath):
-                    try:
-                        self._extract_file(filepath, path)
-                    except FailedToExtractFile as e:
-                        self.logger.error(str(e))
+                    if response is None:
+                        response, offset = self._get_resume_response(url, part_path, validators)
+                    if is_refetch:
+                        total_size, _ = self._get_content_info(response)
+                        if self._is_too_large(filename, total_size):
+                            response.close()
+                            self._remove_journal(part_path)
+                            return
+                        validators = self._get_validators(response, total_size)
+                        self._write_journal(part_path, validators)
+                        is_refetch = False
+
+                    if response is None:
+                        self.logger.info(f'"{filename}" was already fully downloaded')
+                    elif total_size is None:
+                        header = self._download_file_without_size(response, part_path, filename, offset)
+                    else:
+                        header = self._download_file_with_size(response, part_path, filename, total_size, offset)
+                    self._check_header(header, filename, response)
+
+                self._finish_download(part_path, filepath, path, validators, header)
                 break
-            except (ConnectionError, IncompleteRead) as e:
+            except RangeNotHonoured as e:
+                # Ranges are advertised but not served (or the file changed
+                # under If-Range), stream the current version in one piece
+                self.logger.warning(f"{e}, downloading \"{filename}\" in one stream")
+                segments = []
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                response = None
+                is_refetch = True
+            except (ConnectionError, ChunkedEncodingError, IncompleteRead) as e:
                 attempt += 1
+                self.metrics.incr("download_retries", reason="connection")
                 self.logger.warning(f"Download failed: {e}. Retrying {attempt}/{retries}...")
+                response = None
+                time.sleep(0.5)
+            except UnexpectedHTMLPage as e:
+                attempt += 1
+                if attempt >= retries:
+                    # Served as HTML every time, it may be the real content
+                    self.logger.warning(f"{e}, keeping it after {retries} attempts")
+                    self._finish_download(part_path, filepath, path, validators, header)
+                    break
+
+                # Likely an error page, the next attempt starts over
+                self.logger.warning(f"{e}. Retrying {attempt}/{retries}...")
+                self.metrics.incr("download_retries", reason="html_page")
+                os.remove(part_path)
+                response = None
                 time.sleep(0.5)
         else:
             self.logger.error(f'Failed to download "{filename}" after {retries} attempts')
+            self.metrics.incr("files_failed")
+            # A partial file is kept for the next run, a discarded one isn't
+            if not os.path.exists(part_path):
+                self._remove_journal(part_path)
+
+    def _finish_download(self, part_path: str, filepath: str, path: str, validators: Dict, header: Optional[bytes]) -> None:
+        """Move a complete ".part" file in place, store, record and extract it"""
+        os.replace(part_path, filepath)
+        self._remove_journal(part_path)
+        self.metrics.incr("files_downloaded")
+        digest = None
+        if self.store is not None:
+            digest = self.store.add(filepath, validators)
+        self._record_validators(filepath, validators)
+
+        self._extract_downloaded(filepath, path, header, digest)
+
+    def _extract_downloaded(
+        self,
+        filepath: str,
+        path: str,
+        header: Optional[bytes] = None,
+        digest: Optional[str] = None,
+    ) -> None:
+        """
+        After successful download, check if it's compressed and extract
+
+        The digest computed by the file store is passed along, so the archive
+        isn't read again only to check its extraction marker.
+        """
+        if not os.path.exists(filepath):
+            return
+
+        if not self.extract_jobs:
+            try:
+                with self.metrics.span("extract"):
+                    self._extract_file(filepath, path, header, digest)
+            except FailedToExtractFile as e:
+                self.metrics.incr("extractions_failed")
+                self.logger.error(str(e))
+            return
+
+        # Extraction is CPU bound, hand it to the process pool and go back to
+        # downloading
+        extension = self._get_compression_type(filepath, header)
+        if not extension:
+            return
+
+        future = self._get_extract_pool().submit(
+            extract_archive_timed,
+            os.path.abspath(filepath),
+            os.path.abspath(path),
+            extension,
+            self.max_extract_bytes,
+            self.max_extract_ratio,
+            self.max_extract_depth,
+            digest,
+            self.is_force,
+        )
+        # Done callbacks run after the waiters of a future are woken, wait()
+        # waits for this one instead so the results are reported by then
+        reported: Future = Future()
+        future.add_done_callback(
+            lambda f: self._on_extracted(f, os.path.basename(filepath), path, reported)
+        )
+        with self._lock:
+            self.extractions.append(reported)
+
+    def _log_extracted(self, filename: str, extract_path: str, written: Optional[int]) -> None:
+        if written is None:
+            self.metrics.incr("extractions_skipped")
+            self.logger.info(f'Skipping extraction of "{filename}" (unchanged archive)')
+        else:
+            self.metrics.incr("extractions")
+            self.metrics.incr("bytes_extracted", written)
+            self.logger.info(f'Successfully extracted "{filename}" to {extract_path}')
+
+    def _get_extract_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self.extract_pool is None:
+                # Forking a process running download threads is unsafe
+                self.extract_pool = ProcessPoolExecutor(
+                    max_workers=self.extract_jobs,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self.extract_pool
+
+    def _on_extracted(self, future: Future, filename: str, extract_path: str, reported: Future) -> None:
+        """Report the result of an extraction ran by the process pool"""
+        try:
+            if future.cancelled():
+                return
+
+            error = future.exception()
+            if error is None:
+                written, elapsed = future.result()
+                self.metrics.observe("extract", elapsed)
+                self._log_extracted(filename, extract_path, written)
+                return
+
+            self.metrics.incr("extractions_failed")
+            self.logger.error(
+                str(FailedToExtractFile(f'Failed to extract "{filename}": {str(error)}'))
+            )
+        finally:
+            reported.set_result(None)
+
+    def _check_header(self, header: Optional[bytes], filename: str, response) -> None:
+        """Refuse an HTML page the server sent as such for a binary file name"""
+        if not header or filename.lower().endswith(self.TEXT_EXTENSIONS):
+            return
+
+        content_type = response.headers.get("Content-Type", "").lower()
+        if not content_type.startswith("text/html"):
+            return
+
+        start = header.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+        if start.startswith(self.HTML_SIGNATURES):
+            raise UnexpectedHTMLPage(f'"{filename}" is an HTML page')
+
+    def _get_file_key(self, filepath: str) -> str:
+        if self.root:
+            filepath = os.path.relpath(filepath, self.root)
+        return filepath.replace(os.sep, "/")
+
+    def _record_validators(self, filepath: str, validators: Dict) -> None:
+        """Remember the version of a downloaded file for later revalidation"""
+        record = {
+            key: validators[key] for key in ("etag", "last_modified", "length")
+        }
+        key = self._get_file_key(filepath)
+        with self._lock:
+            self.file_validators[key] = record
+        if self.on_record is not None:
+            self.on_record(key, record)
+
+    def _get_conditional_headers(self, filepath: str) -> Optional[Dict]:
+        """
+        Build "If-None-Match"/"If-Modified-Since" headers for an existing file
+
+        Returns:
+            Headers dict, empty if the file is missing or forced, None if the
+            file exists but its version is unknown
+        """
+        if self.is_force or not os.path.exists(filepath):
+            return {}
+
+        with self._lock:
+            record = self.file_validators.get(self._get_file_key(filepath))
+        if not record or not (record["etag"] or record["last_modified"]):
+            return None
+
+        headers = {}
+        if record["etag"]:
+            headers["If-None-Match"] = record["etag"]
+        if record["last_modified"]:
+            headers["If-Modified-Since"] = record["last_modified"]
+        return headers
+
+    @staticmethod
+    def _get_validators(response, total_size: Optional[int]) -> Dict:
+        """Collect the response fields that identify the file version"""
+        return {
+            "url": response.url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "length": total_size,
+            "accept_ranges": response.headers.get("Accept-Ranges", "").lower() == "bytes",
+        }
+
+    def _can_resume(self, part_path: str, validators: Dict) -> bool:
+        """Check if a ".part" file left by a previous run belongs to this file"""
+        if not validators["accept_ranges"] or not os.path.exists(part_path):
+            return False
+
+        if os.path.getsize(part_path) == 0:
+            return False
+
+        journal = self._read_journal(part_path)
+        if journal is None or "segments" in journal:
+            # A preallocated segmented file has holes, it can't be appended to
+            return False
+
+        same_version = all(
+            journal.get(key) == validators[key]
+            for key in ("etag", "last_modified", "length")
+        )
+        # Without validators only the exact same URL can be trusted
+        has_validator = validators["etag"] or validators["last_modified"]
+        return same_version and (has_validator or journal.get("url") == validators["url"])
+
+    def _get_resume_response(self, url: str, part_path: str, validators: Dict) -> Tuple:
+        """
+        Request the rest of the file, or the whole file if it can't be resumed
+
+        Returns:
+            Response and the offset it starts at. The response is None when
+            the ".part" file is already complete (the previous run died
+            before renaming it)
+        """
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if not offset or not validators["accept_ranges"]:
+            return self._get_response(url), 0
+
+        length = int(validators["length"]) if validators["length"] else None
+        if length is not None and offset == length:
+            return None, offset
+        if length is not None and offset > length:
+            # Not a prefix of this version, start over
+            os.remove(part_path)
+            return self._get_response(url), 0
+
+        headers = {"Range": f"bytes={offset}-", **self._get_if_range(validators)}
+        response = self.session.get(url, headers=headers, stream=True)
+        if response.status_code == 416:
+            # The server has nothing past offset, the ".part" can't be trusted
+            response.close()
+            os.remove(part_path)
+            return self._get_response(url), 0
+        response = self._check_response(url, response)
+        content_range = response.headers.get("Content-Range", "")
+        if response.status_code == 206:
+            if content_range.startswith(f"bytes {offset}-"):
+                return response, offset
+            # Some other range, it can't be appended nor used as the file
+            response.close()
+            return self._get_response(url), 0
+
+        # The server sent the full file (changed or ranges ignored), start over
+        return response, 0
+
+    @staticmethod
+    def _get_if_range(validators: Dict) -> Dict:
+        """Build the "If-Range" header so a changed file is sent in full"""
+        if validators["etag"] and not validators["etag"].startswith("W/"):
+            return {"If-Range": validators["etag"]}
+        if validators["last_modified"]:
+            return {"If-Range": validators["last_modified"]}
+        return {}
+
+    def _get_segments(self, validators: Dict) -> List[Tuple[int, int]]:
+        """Split the file into byte ranges, empty if it should be streamed"""
+        total_size = validators["length"]
+        if self.segments < 2 or not total_size or not validators["accept_ranges"]:
+            return []
+
+        total_size = int(total_size)
+        count = min(self.segments, total_size // self.SEGMENT_MIN_SIZE)
+        if count < 2:
+            return []
+
+        step = -(-total_size // count)
+        return [
+            (start, min(start + step, total_size) - 1)
+            for start in range(0, total_size, step)
+        ]
+
+    def _download_file_segmented(
+        self,
+        url: str,
+        part_path: str,
+        filename: str,
+        validators: Dict,
+        segments: List[Tuple[int, int]],
+    ) -> None:
+        """Download byte ranges in parallel into a preallocated file"""
+        total_size = int(validators["length"])
+        journal = self._read_journal(part_path) or {}
+        done = set()
+        if (
+            os.path.exists(part_path)
+            and journal.get("segments") == len(segments)
+            and all(journal.get(key) == validators[key] for key in ("etag", "last_modified", "length"))
+        ):
+            done = set(journal.get("done", []))
+        else:
+            with open(part_path, "wb") as file:
+                file.truncate(total_size)
+        self._write_journal(part_path, {**validators, "segments": len(segments), "done": sorted(done)})
+
+        with tqdm.tqdm(
+            desc=f'Downloading "{filename}"',
+            total=total_size,
+            initial=sum(end - start + 1 for index, (start, end) in enumerate(segments) if index in done),
+            unit="B",
+            unit_scale=True,
+            unit_divisor=1024,
+            leave=False,
+        ) as bar, ThreadPoolExecutor(max_workers=len(segments)) as executor:
+            futures = {
+                executor.submit(self._download_segment, url, part_path, start, end, validators, bar): index
+                for index, (start, end) in enumerate(segments)
+                if index not in done
+            }
+            error = None
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+
+                # Only fully written segments are journaled, a retry (or the
+                # next run) fetches the missing ones again
+                done.add(futures[future])
+                self._write_journal(part_path, {**validators, "segments": len(segments), "done": sorted(done)})
+
+            if error is not None:
+                raise error
+
+    def _download_segment(
+        self, url: str, part_path: str, start: int, end: int, validators: Dict, bar
+    ) -> None:
+        """Fetch bytes start-end and write them at their position in the file"""
+        headers = {"Range": f"bytes={start}-{end}", **self._get_if_range(validators)}
+        response = self._get_response(url, headers)
+        if response.status_code != 206:
+            response.close()
+            raise RangeNotHonoured(f"Range requests not honoured by {url}")
+
+        with open(part_path, "r+b", buffering=self.WRITE_BUFFER_SIZE) as file:
+            file.seek(start)
+            # Never write past the end of the requested range
+            written, _ = self._write_response(response, file, bar, limit=end + 1 - start)
+        response.close()
+
+        if start + written != end + 1:
+            raise ConnectionError(f"Segment {start}-{end} of {url} is incomplete")
+
+    @classmethod
+    def _read_journal(cls, part_path: str) -> Optional[Dict]:
+        journal_path = part_path[: -len(cls.PART_SUFFIX)] + cls.JOURNAL_SUFFIX
+        try:
+            with open(journal_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def _write_journal(cls, part_path: str, validators: Dict) -> None:
+        journal_path = part_path[: -len(cls.PART_SUFFIX)] + cls.JOURNAL_SUFFIX
+        with open(journal_path, "w", encoding="utf-8") as f:
+            json.dump(validators, f)
+
+    @classmethod
+    def _remove_journal(cls, part_path: str) -> None:
+        journal_path = part_path[: -len(cls.PART_SUFFIX)] + cls.JOURNAL_SUFFIX
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+
+    @classmethod
+    def _open_part(cls, part_path: str, offset: int):
+        """Open the ".part" file for writing at offset"""
+        if not offset:
+            return open(part_path, "wb", buffering=cls.WRITE_BUFFER_SIZE)
+
+        file = open(part_path, "r+b", buffering=cls.WRITE_BUFFER_SIZE)
+        file.truncate(offset)
+        file.seek(offset)
+        return file
 
     def invoke(self, getable_url: str, path: str, filename: str) -> None:
         """
@@ -162,13 +705,61 @@ class DownloadManager:
             path: Download directory path
             filename: Output filename
         """
-        response = self._get_response(getable_url)
-        total_size, is_binary = self._get_content_info(response)
+        filepath = os.path.join(path, filename)
+        with self._claim_file(filepath, filename) as is_claimed:
+            if not is_claimed:
+                return
 
-        if not is_binary:
-            self.logger.warning(f'Warning: "{filename}" might be a text file')
+            headers = self._get_conditional_headers(filepath)
+            if headers is None:
+                # Nothing to revalidate against, keep the file we already have
+                self.metrics.incr("files_skipped", reason="exists")
+                self.logger.info(f'Skipping "{filename}" (already downloaded)')
+                return
+
+            response = self._get_response(getable_url, headers)
+            if response.status_code == 304:
+                response.close()
+                self.metrics.incr("files_skipped", reason="not_modified")
+                self.logger.info(f'Skipping "{filename}" (not modified)')
+                return
+
+            total_size, is_binary = self._get_content_info(response)
+
+            if not is_binary:
+                self.logger.warning(f'Warning: "{filename}" might be a text file')
+
+            self.download_with_progress(
+                response, path, filename, total_size, revalidated=bool(headers)
+            )
+
+    @contextmanager
+    def _claim_file(self, filepath: str, filename: str):
+        """
+        Hold the download lock of filepath
+
+        Yields:
+            False if another download of this run already produced the file,
+            which is then skipped like an existing file
+        """
+        key = os.path.abspath(filepath)
+        with self._lock:
+            file_lock = self._file_locks.setdefault(key, threading.RLock())
+
+        with file_lock:
+            if key in self._handled_files:
+                self.metrics.incr("files_skipped", reason="exists")
+                self.logger.info(f'Skipping "{filename}" (already downloaded)')
+                yield False
+                return
 
-        self.download_with_progress(response, path, filename, total_size)
+            try:
+                yield True
+            finally:
+                # A failed download leaves the path to the next candidate
+                if os.path.exists(filepath):
+                    with self._lock:
+                        self._handled_files.add(key)
 
     def download(self, url: str, path: str) -> None:
         """
@@ -181,15 +772,55 @@ class DownloadManager:
         # Ensure download directory exists
         os.makedirs(path, exist_ok=True)
 
-        # Try specialized sources first
-        for source_class in SOURCES:
-            source = source_class(self, self.session)
-            if source.is_valid(url):
-                source.download(url, path)
-                return
+        with self.metrics.span("download"):
+            try:
+                # Try specialized sources first
+                for source_class in SOURCES:
+                    source = source_class(self, self.session)
+                    if source.is_valid(url):
+                        source.download(url, path)
+                        return
+
+                # Fall back to direct download
+                self.direct_download(url, path)
+            except Exception:
+                self.metrics.incr("files_failed")
+                raise
 
-        # Fall back to direct download
-        self.direct_download(url, path)
+    def submit(self, url: str, path: str) -> Future:
+        """
+        Queue a download on the scheduler
+
+        Args:
+            url: URL to download from
+            path: Download directory path
+
+        Returns:
+            Future resolved once the file is downloaded
+        """
+        future = self.scheduler.submit(urlparse(url).netloc, self.download, url, path)
+        with self._lock:
+            self.downloads.append(future)
+        return future
+
+    def wait(self) -> None:
+        """Block until every download and extraction of this manager is finished"""
+        with self._lock:
+            downloads, self.downloads = self.downloads, []
+        # Downloads queue their extraction when done
+        wait_futures(downloads)
+        with self._lock:
+            extractions, self.extractions = self.extractions, []
+        wait_futures(extractions)
+
+    def close(self) -> None:
+        """Finish the pending work and stop the worker threads and processes"""
+        self.wait()
+        if self.owns_scheduler:
+            self.scheduler.shutdown()
+        if self.extract_pool is not None and self.owns_extract_pool:
+            self.extract_pool.shutdown()
+            self.extract_pool = None
 
     def direct_download(self, url: str, path: str) -> None:
         """Handle direct URL download when no source matches"""
@@ -218,22 +849,37 @@ class DownloadManager:
 
         return None, is_binary
 
-    def _get_response(self, url: str):
+    def _get_response(self, url: str, headers: Optional[Dict] = None):
         """Get response from URL with error handling"""
-        response = self.session.get(url, stream=True)
-        if response.status_code != 200:
-            raise FailedToDownloadFile(f"Failed to download from {url}")
+        response = self.session.get(url, headers=headers, stream=True)
+        return self._check_response(url, response)
+
+    @staticmethod
+    def _check_response(url: str, response):
+        if response.status_code not in (200, 206, 304):
+            raise FailedToDownloadFile(
+                f"Failed to download from {url} (HTTP {response.status_code})"
+            )
         return response
 
     def _should_skip_download(
-        self, filepath: str, filename: str, total_size: Optional[int]
+        self,
+        filepath: str,
+        filename: str,
+        total_size: Optional[int],
+        revalidated: bool = False,
     ) -> bool:
         """Check if download should be skipped"""
-        if os.path.exists(filepath) and not self.is_force:
+        if os.path.exists(filepath) and not self.is_force and not revalidated:
+            self.metrics.incr("files_skipped", reason="exists")
             self.logger.info(f'Skipping "{filename}" (already downloaded)')
             return True
 
+        return self._is_too_large(filename, total_size)
+
+    def _is_too_large(self, filename: str, total_size: Optional[int]) -> bool:
         if total_size and total_size > self.max_size_bytes:
+            self.metrics.incr("files_skipped", reason="too_large")
             self.logger.info(
                 f'Skipping "{filename}" with size {helper.size_converter(total_size)} (size too large)'
             )
@@ -242,41 +888,155 @@ class DownloadManager:
         return False
 
     def _download_file_with_size(
-        self, response, filepath: str, filename: str, total_size: int
-    ) -> None:
-        """Download file with known size using progress bar"""
-        with open(filepath, "wb") as file, tqdm.tqdm(
+        self, response, filepath: str, filename: str, total_size: int, offset: int = 0
+    ) -> Optional[bytes]:
+        """
+        Download file with known size using progress bar
+
+        Returns:
+            First bytes of the file, None when resuming at offset
+        """
+        header = b"" if not offset else None
+        with self._open_part(filepath, offset) as file, tqdm.tqdm(
             desc=f'Downloading "{filename}"',
             total=total_size,
+            initial=offset,
             unit="B",
             unit_scale=True,
             unit_divisor=1024,
             leave=False,
         ) as bar:
-            for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
-                size = file.write(chunk)
-                bar.update(size)
+            written, header = self._write_response(response, file, bar, header)
+        self._check_complete(response, written)
+        return header
 
     def _download_file_without_size(
-        self, response, filepath: str, filename: str
-    ) -> None:
-        """Download file with unknown size using simplified progress"""
-        downloaded_size = 0
-        with open(filepath, "wb") as file, tqdm.tqdm(
+        self, response, filepath: str, filename: str, offset: int = 0
+    ) -> Optional[bytes]:
+        """
+        Download file with unknown size using simplified progress
+
+        Returns:
+            First bytes of the file, None when resuming at offset
+        """
+        header = b"" if not offset else None
+        with self._open_part(filepath, offset) as file, tqdm.tqdm(
             desc=f'Downloading "{filename}"',
+            initial=offset,
             unit="B",
             unit_scale=True,
             unit_divisor=1024,
             leave=False,
         ) as bar:
-            for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
-                size = file.write(chunk)
-                downloaded_size += size
-                bar.update(size)
+            written, header = self._write_response(response, file, bar, header)
+        self._check_complete(response, written)
 
         self.logger.info(
-            f'Downloaded "{filename}" ({helper.size_converter(downloaded_size)})'
+            f'Downloaded "{filename}" ({helper.size_converter(offset + written)})'
         )
+        return header
+
+    @staticmethod
+    def _check_complete(response, written: int) -> None:
+        """
+        Refuse a body shorter than its Content-Length
+
+        urllib3 < 2 doesn't enforce the length, a connection closed early
+        would otherwise be saved as a complete file. Raises an IncompleteRead
+        so the download is resumed like any broken transfer.
+        """
+        encoding = response.headers.get("Content-Encoding", "identity").lower()
+        if encoding != "identity":
+            # Content-Length counts the encoded bytes, not the written ones
+            return
+
+        try:
+            expected = int(response.headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            return
+        if written < expected:
+            raise TruncatedBody(written, expected - written)
+
+    def _iter_chunks(self, response):
+        """
+        Read the response body in chunks sized to the transfer rate
+
+        A read that fills its buffer within CHUNK_TARGET_TIME doubles the next
+        one (up to the configured chunk size), a slow one halves it, so fast
+        links move multi-MB chunks while slow ones still report progress.
+        """
+        if response.raw is None or response.raw.closed:
+            # The body was already read (e.g. parsed as HTML), replay it
+            yield from response.iter_content(chunk_size=self.chunk_size)
+            return
+
+        chunk_size = min(self.CHUNK_SIZE, self.chunk_size)
+        try:
+            while True:
+                started = time.monotonic()
+                chunk = response.raw.read(chunk_size, decode_content=True)
+                if not chunk:
+                    return
+                yield chunk
+
+                elapsed = time.monotonic() - started
+                if len(chunk) >= chunk_size and elapsed < self.CHUNK_TARGET_TIME:
+                    chunk_size = min(chunk_size * 2, self.chunk_size)
+                elif elapsed > 2 * self.CHUNK_TARGET_TIME:
+                    chunk_size = max(chunk_size // 2, min(self.CHUNK_SIZE, self.chunk_size))
+        # Same mapping as Response.iter_content, so the retry loop sees the
+        # requests exceptions
+        except ProtocolError as e:
+            raise ChunkedEncodingError(e)
+        except DecodeError as e:
+            raise ContentDecodingError(e)
+        except ReadTimeoutError as e:
+            raise ConnectionError(e)
+
+    def _write_response(
+        self, response, file, bar, header: Optional[bytes] = None, limit: Optional[int] = None
+    ) -> Tuple[int, Optional[bytes]]:
+        """
+        Stream the response body into file
+
+        Args:
+            response: Streamed response
+            file: File opened for writing at the right offset
+            bar: Progress bar, updated at most every PROGRESS_INTERVAL seconds
+            header: Magic bytes seen so far, None to skip collecting them
+            limit: Max number of bytes to write
+
+        Returns:
+            Number of bytes written and the first bytes of the file
+        """
+        written = 0
+        pending = 0
+        last_update = time.monotonic()
+        try:
+            for chunk in self._iter_chunks(response):
+                if limit is not None:
+                    chunk = chunk[: limit - written]
+                # Keep the magic bytes while streaming, no second pass needed
+                if header is not None and len(header) < MAGIC_HEADER_SIZE:
+                    header += chunk[: MAGIC_HEADER_SIZE - len(header)]
+                size = file.write(chunk)
+                written += size
+                pending += size
+
+                now = time.monotonic()
+                if now - last_update >= self.PROGRESS_INTERVAL:
+                    bar.update(pending)
+                    pending = 0
+                    last_update = now
+                if limit is not None and written >= limit:
+                    break
+        finally:
+            # Bytes of a broken transfer were received all the same
+            self.metrics.incr("bytes_downloaded", written)
+
+        if pending:
+            bar.update(pending)
+        return written, header
 
     def _log_download_start(self, filename: str, size: Optional[int]) -> None:
         """Log download start with file info"""
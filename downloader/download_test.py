@@ -0,0 +1,309 @@
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+from unittest import mock
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from urllib3.response import HTTPResponse
+
+from downloader import DownloadManager
+from downloader.store import BlobStore
+
+URL = "http://ctf.test/files/chall.bin"
+CONTENT = bytes(range(256)) * 400
+ETAG = '"v1"'
+
+
+class FakeServer:
+    """Session serving CONTENT at URL, with switches for misbehaving servers"""
+
+    def __init__(self, content: bytes = CONTENT, etag: str = ETAG):
+        self.content = content
+        self.etag = etag
+        self.accept_ranges = True
+        # Answer range requests with the whole file
+        self.ignore_ranges = False
+        # Answer range requests with a range starting at this offset
+        self.wrong_range_start = None
+        # Close the connection after this many bytes, for the first responses
+        self.truncate_at = None
+        self.truncate_count = 0
+        # Request numbers failing with a connection error
+        self.failing = set()
+        # New (content, etag) served from a request number on
+        self.updates = {}
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def get(self, url, headers=None, stream=True, **kwargs):
+        headers = dict(headers or {})
+        with self._lock:
+            index = len(self.requests)
+            self.requests.append(headers)
+            if index in self.updates:
+                self.content, self.etag = self.updates[index]
+        if index in self.failing:
+            raise requests.ConnectionError(f"request {index} failed")
+
+        start = 0
+        status = 200
+        range_header = headers.get("Range")
+        # A changed file is sent in full
+        is_current = headers.get("If-Range", self.etag) == self.etag
+        if range_header and self.accept_ranges and not self.ignore_ranges and is_current:
+            first, _, last = range_header[len("bytes="):].partition("-")
+            start = int(first)
+            end = int(last) if last else len(self.content) - 1
+            if start >= len(self.content):
+                return self._response(url, 416, b"", {})
+            if self.wrong_range_start is not None:
+                start = self.wrong_range_start
+            status = 206
+
+        body = self.content[start:end + 1] if status == 206 else self.content
+        response_headers = {
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(len(body)),
+            "ETag": self.etag,
+        }
+        if self.accept_ranges:
+            response_headers["Accept-Ranges"] = "bytes"
+        if status == 206:
+            response_headers["Content-Range"] = (
+                f"bytes {start}-{start + len(body) - 1}/{len(self.content)}"
+            )
+        if self.truncate_count and self.truncate_at is not None:
+            self.truncate_count -= 1
+            body = body[: self.truncate_at]
+        return self._response(url, status, body, response_headers)
+
+    @staticmethod
+    def _response(url, status, body, headers):
+        response = requests.Response()
+        response.url = url
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        # Like urllib3 1.26, a short body isn't an error at this level
+        response.raw = HTTPResponse(
+            body=io.BytesIO(body),
+            headers=headers,
+            status=status,
+            preload_content=False,
+            decode_content=False,
+            enforce_content_length=False,
+        )
+        return response
+
+
+class DownloadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.path, "chall.bin")
+        self.part_path = self.filepath + DownloadManager.PART_SUFFIX
+        self.server = FakeServer()
+        self.manager = self.get_manager()
+
+    def tearDown(self):
+        self.manager.close()
+        shutil.rmtree(self.path)
+
+    def get_manager(self, **kwargs):
+        return DownloadManager(
+            self.server,
+            logging.getLogger("download_test"),
+            False,
+            100,
+            root=self.path,
+            **kwargs,
+        )
+
+    def write_part(self, size: int, etag: str = ETAG) -> None:
+        """Leave the ".part" file and journal of an interrupted download"""
+        with open(self.part_path, "wb") as f:
+            f.write(self.server.content[:size])
+        journal_path = self.filepath + DownloadManager.JOURNAL_SUFFIX
+        with open(journal_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "url": URL,
+                    "etag": etag,
+                    "last_modified": None,
+                    "length": len(self.server.content),
+                    "accept_ranges": True,
+                },
+                f,
+            )
+
+    def assertDownloaded(self):
+        with open(self.filepath, "rb") as f:
+            self.assertEqual(f.read(), self.server.content)
+        self.assertFalse(os.path.exists(self.part_path))
+        self.assertFalse(os.path.exists(self.filepath + DownloadManager.JOURNAL_SUFFIX))
+
+
+class ResumeTest(DownloadTestCase):
+    def test_resumes_from_part_size(self):
+        self.write_part(1000)
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertDownloaded()
+        self.assertEqual(self.server.requests[-1]["Range"], "bytes=1000-")
+        self.assertEqual(self.server.requests[-1]["If-Range"], ETAG)
+
+    def test_changed_file_starts_over(self):
+        self.write_part(1000, etag='"v0"')
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertDownloaded()
+        self.assertNotIn("Range", self.server.requests[-1])
+
+    def test_ignored_range_starts_over(self):
+        self.write_part(1000)
+        self.server.ignore_ranges = True
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertDownloaded()
+
+    def test_wrong_content_range_starts_over(self):
+        self.write_part(1000)
+        self.server.wrong_range_start = 500
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertDownloaded()
+        self.assertNotIn("Range", self.server.requests[-1])
+
+    def test_complete_part_is_not_fetched_again(self):
+        self.write_part(len(CONTENT))
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertDownloaded()
+        # Only the request that found the file, no range request
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_oversized_part_starts_over(self):
+        self.write_part(len(CONTENT))
+        with open(self.part_path, "ab") as f:
+            f.write(b"garbage")
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertDownloaded()
+
+    def test_truncated_body_is_resumed(self):
+        self.server.truncate_at = 3000
+        self.server.truncate_count = 1
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertDownloaded()
+        self.assertEqual(self.server.requests[-1]["Range"], "bytes=3000-")
+
+    def test_truncated_body_without_ranges_is_fetched_again(self):
+        self.server.accept_ranges = False
+        self.server.truncate_at = 3000
+        self.server.truncate_count = 2
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertDownloaded()
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_truncated_body_is_never_kept(self):
+        self.server.accept_ranges = False
+        self.server.truncate_at = 3000
+        self.server.truncate_count = 3
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertFalse(os.path.exists(self.filepath))
+        self.assertEqual(self.manager.metrics.get("files_failed"), 1)
+
+
+
+class SegmentedDownloadTest(DownloadTestCase):
+    def get_manager(self, **kwargs):
+        manager = super().get_manager(segments=4, **kwargs)
+        manager.SEGMENT_MIN_SIZE = 4096
+        return manager
+
+    def test_segments(self):
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertDownloaded()
+        ranges = sorted(request["Range"] for request in self.server.requests[1:])
+        self.assertEqual(len(ranges), 4)
+        self.assertEqual(ranges[0], "bytes=0-25599")
+
+    def test_ignored_ranges_fall_back_to_one_stream(self):
+        self.server.ignore_ranges = True
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertDownloaded()
+        self.assertNotIn("Range", self.server.requests[-1])
+        self.assertEqual(self.manager.metrics.get("download_retries"), 0)
+
+    def test_fallback_request_is_retried(self):
+        self.server.ignore_ranges = True
+        # The invoke request and the 4 segments succeed, the next one fails
+        self.server.failing = {5}
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertDownloaded()
+        self.assertEqual(self.manager.metrics.get("download_retries"), 1)
+
+    def test_fallback_gets_the_new_version(self):
+        new_content = CONTENT[::-1] + b"v2"
+        self.server.updates = {1: (new_content, '"v2"')}
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertDownloaded()
+        record = self.manager.file_validators["chall.bin"]
+        self.assertEqual(record["etag"], '"v2"')
+        self.assertEqual(record["length"], len(new_content))
+
+    def test_fallback_checks_the_new_size(self):
+        self.manager.max_size_bytes = len(CONTENT) * 2
+        self.server.updates = {1: (CONTENT * 3, '"v2"')}
+        self.manager.invoke(URL, self.path, "chall.bin")
+
+        self.assertFalse(os.path.exists(self.filepath))
+        self.assertFalse(os.path.exists(self.part_path))
+        self.assertFalse(os.path.exists(self.filepath + DownloadManager.JOURNAL_SUFFIX))
+        self.assertEqual(self.manager.metrics.get("files_skipped"), 1)
+
+
+
+class StoreExtractionTest(DownloadTestCase):
+    def setUp(self):
+        super().setUp()
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            archive.writestr("flag.txt", b"flag")
+        self.server.content = buffer.getvalue()
+
+    def get_manager(self, **kwargs):
+        return super().get_manager(store_path=os.path.join(self.path, "store"), **kwargs)
+
+    def test_archive_is_hashed_once(self):
+        with mock.patch.object(BlobStore, "hash_file", wraps=BlobStore.hash_file) as hash_file:
+            self.manager.invoke(URL, self.path, "chall.zip")
+        self.manager.wait()
+
+        self.assertEqual(hash_file.call_count, 1)
+        self.assertTrue(os.path.exists(os.path.join(self.path, "flag.txt")))
+
+    def test_linked_archive_is_not_hashed(self):
+        self.manager.invoke(URL, self.path, "chall.zip")
+
+        # Same URL under another name, served from the store
+        with mock.patch.object(BlobStore, "hash_file", wraps=BlobStore.hash_file) as hash_file:
+            self.manager.invoke(URL, self.path, "copy.zip")
+        self.assertEqual(self.manager.metrics.get("files_linked"), 1)
+        hash_file.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,447 @@
+import os
+import tarfile
+import time
+import zipfile
+from typing import List, Optional, Tuple
+
+import py7zr
+import rarfile
+from py7zr.io import Py7zIO, WriterFactory
+
+from downloader.store import BlobStore
+
+COMPRESSED_EXTENSIONS = {
+    ".zip": "zip",
+    ".rar": "rar",
+    ".7z": "7z",
+    ".tar": "tar",
+    ".tar.gz": "tar.gz",
+    ".tgz": "tar.gz",
+    ".tar.bz2": "tar.bz2",
+    ".tbz2": "tar.bz2",
+}
+
+# (offset, signature, compression type)
+MAGIC_SIGNATURES = [
+    (0, b"PK\x03\x04", "zip"),
+    (0, b"PK\x05\x06", "zip"),
+    (0, b"Rar!\x1a\x07", "rar"),
+    (0, b"7z\xbc\xaf\x27\x1c", "7z"),
+    (0, b"\x1f\x8b", "tar.gz"),
+    (0, b"BZh", "tar.bz2"),
+    (257, b"ustar", "tar"),
+]
+MAGIC_HEADER_SIZE = 262
+
+# Zip based formats which are files on their own, never unpack them
+MAGIC_EXCLUDED_EXTENSIONS = {
+    ".apk",
+    ".docx",
+    ".epub",
+    ".ipa",
+    ".jar",
+    ".odp",
+    ".ods",
+    ".odt",
+    ".pptx",
+    ".war",
+    ".whl",
+    ".xlsx",
+    ".xpi",
+}
+
+EXTRACTED_MARKER = ".{}.extracted"
+
+
+def sniff_compression_type(header: bytes) -> Optional[str]:
+    """
+    Determine compression type from the first bytes of a file
+
+    Args:
+        header: At least MAGIC_HEADER_SIZE bytes for tar detection
+
+    Returns:
+        String indicating compression type or None if not compressed
+    """
+    for offset, signature, compression_type in MAGIC_SIGNATURES:
+        if header[offset : offset + len(signature)] == signature:
+            return compression_type
+    return None
+
+
+def get_compression_type(filepath: str, header: Optional[bytes] = None) -> Optional[str]:
+    """
+    Determine compression type from the extension, or the magic bytes of
+    files without a known one
+
+    Args:
+        filepath: Path to file
+        header: First MAGIC_HEADER_SIZE bytes of the file, read when missing
+
+    Returns:
+        String indicating compression type or None if not compressed
+    """
+    lower_path = filepath.lower()
+    for ext, comp_type in COMPRESSED_EXTENSIONS.items():
+        if lower_path.endswith(ext):
+            return comp_type
+
+    if os.path.splitext(lower_path)[1] in MAGIC_EXCLUDED_EXTENSIONS:
+        return None
+
+    if header is None:
+        try:
+            with open(filepath, "rb") as file:
+                header = file.read(MAGIC_HEADER_SIZE)
+        except OSError:
+            return None
+
+    compression_type = sniff_compression_type(header)
+
+    # A gzip or bzip2 stream is only handled when it holds a tarball
+    if compression_type in ("tar.gz", "tar.bz2") and not tarfile.is_tarfile(filepath):
+        return None
+    return compression_type
+
+
+class ExtractionLimitExceeded(Exception):
+    """Raised when an archive expands beyond the allowed size or ratio"""
+
+    pass
+
+
+class UnsafeArchiveMember(Exception):
+    """Raised when an archive member would be written outside the target"""
+
+    pass
+
+
+class ExtractionBudget:
+    """Bytes an extraction is allowed to write.
+
+    The budget is checked while the data is copied, so an archive lying about
+    its member sizes still can't write more than ``max_bytes`` bytes or
+    expand more than ``max_ratio`` times its own size.
+    """
+
+    # Small archives may expand a lot (text files), the ratio applies above this
+    RATIO_FLOOR = 1024 * 1024
+
+    def __init__(self, max_bytes: int, max_ratio: float, input_size: int = 0):
+        self.max_bytes = max_bytes
+        self.max_ratio = max_ratio
+        self.input_size = input_size
+        self.written = 0
+
+    def check_declared(self, size: int, compressed_size: Optional[int] = None) -> None:
+        """Fail early on sizes announced by the archive headers"""
+        if self.max_bytes and self.written + size > self.max_bytes:
+            raise ExtractionLimitExceeded(
+                f"archive expands beyond {self.max_bytes} bytes"
+            )
+
+        if (
+            self.max_ratio
+            and compressed_size
+            and size > self.RATIO_FLOOR
+            and size / compressed_size > self.max_ratio
+        ):
+            raise ExtractionLimitExceeded(
+                f"member compression ratio is above {self.max_ratio}"
+            )
+
+    def consume(self, size: int) -> None:
+        self.written += size
+        if self.max_bytes and self.written > self.max_bytes:
+            raise ExtractionLimitExceeded(
+                f"archive expands beyond {self.max_bytes} bytes"
+            )
+
+        if (
+            self.max_ratio
+            and self.input_size
+            and self.written > self.RATIO_FLOOR
+            and self.written / self.input_size > self.max_ratio
+        ):
+            raise ExtractionLimitExceeded(
+                f"archive compression ratio is above {self.max_ratio}"
+            )
+
+
+class _BoundedWriter(Py7zIO):
+    """py7zr writer streaming a member to disk within the budget"""
+
+    def __init__(self, target: str, budget: ExtractionBudget):
+        self.target = target
+        self.budget = budget
+        self.file = open(target, "wb")
+
+    def write(self, s) -> int:
+        self.budget.consume(len(s))
+        return self.file.write(s)
+
+    def read(self, size: Optional[int] = None) -> bytes:
+        return b""
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if self.file.closed:
+            return 0
+        return self.file.seek(offset, whence)
+
+    def flush(self) -> None:
+        if not self.file.closed:
+            self.file.flush()
+
+    def size(self) -> int:
+        return os.path.getsize(self.target)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class _BoundedWriterFactory(WriterFactory):
+    def __init__(self, extractor: "ArchiveExtractor"):
+        self.extractor = extractor
+        self.writers: List[_BoundedWriter] = []
+
+    def create(self, filename: str) -> Py7zIO:
+        # Members are decompressed one after the other, the previous one is done
+        if self.writers:
+            self.writers[-1].close()
+
+        target = self.extractor.open_target(filename)
+        writer = _BoundedWriter(target, self.extractor.budget)
+        self.writers.append(writer)
+        return writer
+
+    def close(self) -> None:
+        for writer in self.writers:
+            writer.close()
+
+
+class ArchiveExtractor:
+    """Extract an archive member by member with bounded buffers.
+
+    Every member path is checked to stay inside the extraction directory and
+    every byte written is charged to an ExtractionBudget. On failure the files
+    written so far are removed.
+    """
+
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, extract_path: str, budget: ExtractionBudget, max_depth: int = 1):
+        self.extract_path = os.path.realpath(extract_path)
+        self.budget = budget
+        self.max_depth = max_depth
+        self.written_files: List[str] = []
+
+    def extract(self, filepath: str, compression_type: str, depth: int = 1) -> int:
+        """
+        Extract an archive, and the archives it holds up to max_depth levels
+
+        Args:
+            filepath: Path to compressed file
+            compression_type: One of the COMPRESSED_EXTENSIONS values
+            depth: Nesting level of this archive
+
+        Returns:
+            Number of bytes written
+        """
+        written = self.budget.written
+        start = len(self.written_files)
+        try:
+            if compression_type == "zip":
+                self._extract_zip(filepath)
+            elif compression_type == "rar":
+                self._extract_rar(filepath)
+            elif compression_type == "7z":
+                self._extract_7z(filepath)
+            elif "tar" in compression_type:
+                self._extract_tar(filepath)
+
+            if depth < self.max_depth:
+                self._extract_nested(self.written_files[start:], depth + 1)
+        except BaseException:
+            self._cleanup()
+            raise
+        return self.budget.written - written
+
+    def _extract_nested(self, files: List[str], depth: int) -> None:
+        """Extract the archives found among files next to themselves"""
+        for member in files:
+            compression_type = get_compression_type(member)
+            if not compression_type:
+                continue
+
+            # Nested archives share the budget of the outer one
+            nested = ArchiveExtractor(os.path.dirname(member), self.budget, self.max_depth)
+            try:
+                nested.extract(member, compression_type, depth)
+            except (ExtractionLimitExceeded, UnsafeArchiveMember):
+                raise
+            except Exception:
+                # A broken or encrypted inner archive is kept as a plain file
+                continue
+            finally:
+                self.written_files.extend(nested.written_files)
+
+    def get_target(self, name: str) -> str:
+        """Resolve the path of a member, refusing anything outside the target"""
+        normalized = name.replace("\\", "/")
+        if normalized.startswith("/") or os.path.splitdrive(normalized)[0]:
+            raise UnsafeArchiveMember(f"Potentially harmful file in archive: {name}")
+
+        target = os.path.realpath(os.path.join(self.extract_path, normalized))
+        if os.path.commonpath([self.extract_path, target]) != self.extract_path:
+            raise UnsafeArchiveMember(f"Potentially harmful file in archive: {name}")
+        return target
+
+    def open_target(self, name: str) -> str:
+        target = self.get_target(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        self.written_files.append(target)
+        return target
+
+    def _copy(self, source, name: str) -> None:
+        target = self.open_target(name)
+        with open(target, "wb") as destination:
+            while True:
+                chunk = source.read(self.BUFFER_SIZE)
+                if not chunk:
+                    break
+                self.budget.consume(len(chunk))
+                destination.write(chunk)
+
+    def _make_dir(self, name: str) -> None:
+        os.makedirs(self.get_target(name), exist_ok=True)
+
+    def _extract_zip(self, filepath: str) -> None:
+        with zipfile.ZipFile(filepath, "r") as zip_ref:
+            for info in zip_ref.infolist():
+                if info.is_dir():
+                    self._make_dir(info.filename)
+                    continue
+
+                self.get_target(info.filename)
+                self.budget.check_declared(info.file_size, info.compress_size)
+                with zip_ref.open(info) as source:
+                    self._copy(source, info.filename)
+
+    def _extract_rar(self, filepath: str) -> None:
+        with rarfile.RarFile(filepath, "r") as rar_ref:
+            for info in rar_ref.infolist():
+                if info.is_dir():
+                    self._make_dir(info.filename)
+                    continue
+
+                if info.is_symlink():
+                    continue
+
+                self.get_target(info.filename)
+                self.budget.check_declared(info.file_size, info.compress_size)
+                with rar_ref.open(info) as source:
+                    self._copy(source, info.filename)
+
+    def _extract_7z(self, filepath: str) -> None:
+        with py7zr.SevenZipFile(filepath, "r") as sz_ref:
+            for info in sz_ref.list():
+                self.get_target(info.filename)
+                if info.is_directory:
+                    self._make_dir(info.filename)
+                    continue
+
+                self.budget.check_declared(info.uncompressed, info.compressed)
+
+            factory = _BoundedWriterFactory(self)
+            try:
+                sz_ref.extract(factory=factory)
+            finally:
+                factory.close()
+
+    def _extract_tar(self, filepath: str) -> None:
+        # Iterating the TarFile reads the headers lazily, one member at a time
+        with tarfile.open(filepath) as tar_ref:
+            for member in tar_ref:
+                if member.isdir():
+                    self._make_dir(member.name)
+                    continue
+
+                # Links and device files are never extracted
+                if not member.isfile():
+                    continue
+
+                self.get_target(member.name)
+                self.budget.check_declared(member.size)
+                source = tar_ref.extractfile(member)
+                with source:
+                    self._copy(source, member.name)
+
+    def _cleanup(self) -> None:
+        for target in reversed(self.written_files):
+            if os.path.isfile(target):
+                os.remove(target)
+        self.written_files.clear()
+
+
+def extract_archive(
+    filepath: str,
+    extract_path: str,
+    compression_type: str,
+    max_bytes: int = 0,
+    max_ratio: float = 0,
+    max_depth: int = 1,
+    digest: Optional[str] = None,
+    force: bool = False,
+) -> Optional[int]:
+    """
+    Safely extract an archive with a fresh budget
+
+    The digest of the archive is saved in a marker file next to it, an archive
+    which was already extracted with the same content is skipped.
+
+    Args:
+        filepath: Path to compressed file
+        extract_path: Directory to extract to
+        compression_type: One of the COMPRESSED_EXTENSIONS values
+        max_bytes: Maximum bytes written over all nesting levels, 0 for no limit
+        max_ratio: Maximum expansion ratio, 0 for no limit
+        max_depth: Number of nested archive levels to extract
+        digest: SHA-256 of the archive if already known (file store)
+        force: Extract even if the marker matches
+
+    Returns:
+        Number of bytes written, None if the archive was already extracted
+    """
+    marker_path = os.path.join(
+        os.path.dirname(filepath), EXTRACTED_MARKER.format(os.path.basename(filepath))
+    )
+    if digest is None:
+        digest = BlobStore.hash_file(filepath)
+    if not force and os.path.exists(marker_path):
+        with open(marker_path, "r", encoding="utf-8") as f:
+            if f.read().strip() == digest:
+                return None
+
+    budget = ExtractionBudget(max_bytes, max_ratio, os.path.getsize(filepath))
+    written = ArchiveExtractor(extract_path, budget, max_depth).extract(
+        filepath, compression_type
+    )
+
+    with open(marker_path, "w", encoding="utf-8") as f:
+        f.write(digest)
+    return written
+
+
+def extract_archive_timed(*args, **kwargs) -> Tuple[Optional[int], float]:
+    """
+    extract_archive, also returning how long it took
+
+    Used by the extraction processes, the time is measured where the work
+    happens instead of including the wait in the pool queue.
+
+    Returns:
+        Result of extract_archive and the extraction time in seconds
+    """
+    started = time.perf_counter()
+    written = extract_archive(*args, **kwargs)
+    return written, time.perf_counter() - started
@@ -0,0 +1,126 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from downloader.extract import (
+    EXTRACTED_MARKER,
+    ExtractionLimitExceeded,
+    UnsafeArchiveMember,
+    extract_archive,
+)
+from downloader.store import BlobStore
+
+
+class ExtractArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.extract_path = os.path.join(self.path, "chall")
+        os.makedirs(self.extract_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_zip(self, name: str, members: dict, path: str = None) -> str:
+        filepath = os.path.join(path or self.extract_path, name)
+        with zipfile.ZipFile(filepath, "w", zipfile.ZIP_DEFLATED) as archive:
+            for member, data in members.items():
+                archive.writestr(member, data)
+        return filepath
+
+    @staticmethod
+    def zip_bytes(members: dict) -> bytes:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for member, data in members.items():
+                archive.writestr(member, data)
+        return buffer.getvalue()
+
+    def test_extracts_members(self):
+        filepath = self.make_zip("chall.zip", {"flag.txt": b"flag", "src/main.c": b"int main;"})
+        written = extract_archive(filepath, self.extract_path, "zip")
+
+        self.assertEqual(written, 13)
+        with open(os.path.join(self.extract_path, "src", "main.c"), "rb") as f:
+            self.assertEqual(f.read(), b"int main;")
+
+    def test_refuses_traversal(self):
+        filepath = self.make_zip("chall.zip", {"ok.txt": b"ok", "../../evil.txt": b"evil"})
+
+        with self.assertRaises(UnsafeArchiveMember):
+            extract_archive(filepath, self.extract_path, "zip")
+        self.assertFalse(os.path.exists(os.path.join(self.path, "evil.txt")))
+        # Members written before the bad one are removed
+        self.assertFalse(os.path.exists(os.path.join(self.extract_path, "ok.txt")))
+
+    def test_refuses_absolute_path(self):
+        filepath = self.make_zip("chall.zip", {"/tmp/evil.txt": b"evil"})
+
+        with self.assertRaises(UnsafeArchiveMember):
+            extract_archive(filepath, self.extract_path, "zip")
+
+    def test_refuses_high_ratio(self):
+        filepath = self.make_zip("bomb.zip", {"zeros": bytes(8 * 1024 * 1024)})
+
+        with self.assertRaises(ExtractionLimitExceeded):
+            extract_archive(filepath, self.extract_path, "zip", max_ratio=100)
+        self.assertFalse(os.path.exists(os.path.join(self.extract_path, "zeros")))
+
+    def test_refuses_too_many_bytes(self):
+        filepath = self.make_zip("big.zip", {"a": b"a" * 4096, "b": b"b" * 4096})
+
+        with self.assertRaises(ExtractionLimitExceeded):
+            extract_archive(filepath, self.extract_path, "zip", max_bytes=6000)
+        self.assertFalse(os.path.exists(os.path.join(self.extract_path, "a")))
+
+    def test_nested_archives_within_depth(self):
+        inner = self.zip_bytes({"flag.txt": b"flag"})
+        filepath = self.make_zip("outer.zip", {"inner.zip": inner})
+
+        extract_archive(filepath, self.extract_path, "zip", max_depth=1)
+        self.assertFalse(os.path.exists(os.path.join(self.extract_path, "flag.txt")))
+
+        extract_archive(filepath, self.extract_path, "zip", max_depth=2, force=True)
+        self.assertTrue(os.path.exists(os.path.join(self.extract_path, "flag.txt")))
+
+    def test_nested_archives_share_the_budget(self):
+        inner = self.zip_bytes({"a": b"a" * 4096})
+        filepath = self.make_zip("outer.zip", {"inner.zip": inner})
+
+        with self.assertRaises(ExtractionLimitExceeded):
+            extract_archive(filepath, self.extract_path, "zip", max_bytes=4096, max_depth=2)
+
+    def test_unchanged_archive_is_skipped(self):
+        filepath = self.make_zip("chall.zip", {"flag.txt": b"flag"})
+        extract_archive(filepath, self.extract_path, "zip")
+        marker_path = os.path.join(self.extract_path, EXTRACTED_MARKER.format("chall.zip"))
+        with open(marker_path, "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), BlobStore.hash_file(filepath))
+
+        self.assertIsNone(extract_archive(filepath, self.extract_path, "zip"))
+
+    def test_force_extracts_again(self):
+        filepath = self.make_zip("chall.zip", {"flag.txt": b"flag"})
+        extract_archive(filepath, self.extract_path, "zip")
+        os.remove(os.path.join(self.extract_path, "flag.txt"))
+
+        self.assertEqual(extract_archive(filepath, self.extract_path, "zip", force=True), 4)
+        self.assertTrue(os.path.exists(os.path.join(self.extract_path, "flag.txt")))
+
+    def test_known_digest_is_not_computed_again(self):
+        filepath = self.make_zip("chall.zip", {"flag.txt": b"flag"})
+        digest = BlobStore.hash_file(filepath)
+
+        with mock.patch.object(BlobStore, "hash_file") as hash_file:
+            extract_archive(filepath, self.extract_path, "zip", digest=digest)
+            self.assertIsNone(
+                extract_archive(filepath, self.extract_path, "zip", digest=digest)
+            )
+        hash_file.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
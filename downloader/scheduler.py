@@ -0,0 +1,101 @@
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, wait
+from queue import Queue
+from typing import Callable, Deque, Dict, List
+
+
+class DownloadScheduler:
+    """Work queue served by a fixed pool of worker threads.
+
+    Tasks are tagged with the host they talk to, at most ``per_host`` tasks of
+    the same host run at once. Tasks of a busy host are parked and requeued
+    when a slot of that host is released, so workers never block on a host.
+    """
+
+    def __init__(self, workers: int = 1, per_host: int = 0):
+        self.workers = max(1, workers)
+        self.per_host = per_host
+        self._queue: Queue = Queue()
+        self._lock = threading.Lock()
+        self._active: Dict[str, int] = defaultdict(int)
+        self._parked: Dict[str, Deque] = defaultdict(deque)
+        self._futures: List[Future] = []
+        self._threads: List[threading.Thread] = []
+
+    def submit(self, host: str, func: Callable, *args, **kwargs) -> Future:
+        """
+        Queue a task
+
+        Args:
+            host: Host the task downloads from, used for the per-host limit
+            func: Callable to run on a worker thread
+
+        Returns:
+            Future resolved with the result of the task
+        """
+        future = Future()
+        with self._lock:
+            self._futures.append(future)
+            self._start_workers()
+        self._queue.put((host, future, func, args, kwargs))
+        return future
+
+    def wait(self) -> None:
+        """Block until every submitted task is done"""
+        while True:
+            with self._lock:
+                pending = [future for future in self._futures if not future.done()]
+                if not pending:
+                    self._futures.clear()
+                    return
+            wait(pending)
+
+    def shutdown(self) -> None:
+        """Wait for the queued tasks and stop the worker threads"""
+        self.wait()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _start_workers(self) -> None:
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _acquire(self, host: str, item) -> bool:
+        with self._lock:
+            if self.per_host and self._active[host] >= self.per_host:
+                self._parked[host].append(item)
+                return False
+            self._active[host] += 1
+            return True
+
+    def _release(self, host: str) -> None:
+        with self._lock:
+            self._active[host] -= 1
+            if self._parked[host]:
+                self._queue.put(self._parked[host].popleft())
+
+    def _worker(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            host, future, func, args, kwargs = item
+            if not self._acquire(host, item):
+                continue
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(func(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                self._release(host)
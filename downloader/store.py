@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from core.challange import Challenge
+
+FICLONE = 0x40049409
+
+
+class BlobStore:
+    """Content addressed store of downloaded files.
+
+    Blobs are kept under ``<root>/blobs/<xx>/<sha256>`` and an index maps the
+    URL, ETag/Last-Modified and size of a download to the digest of its blob,
+    so a file that was already fetched (by another challenge or another
+    event) is linked into place instead of being downloaded again.
+    """
+
+    INDEX_FILE = "index.json"
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.blobs_path = os.path.join(self.root, "blobs")
+        self.index_path = os.path.join(self.root, self.INDEX_FILE)
+        self._lock = threading.Lock()
+        os.makedirs(self.blobs_path, exist_ok=True)
+        self.index: Dict[str, str] = self._load_index()
+
+    @staticmethod
+    def get_key(validators: Dict) -> Optional[str]:
+        """
+        Build the index key of a download
+
+        Args:
+            validators: URL, ETag, Last-Modified and length of the response
+
+        Returns:
+            Key string or None if the response can't be identified safely
+        """
+        version = validators.get("etag") or validators.get("last_modified")
+        if not version or not validators.get("length"):
+            return None
+
+        # Signed download tokens change between sessions, the rest of the
+        # query may address the file (/download?id=1) and is kept
+        url = urlparse(Challenge.normalize_url(validators["url"]))
+        query = f"?{url.query}" if url.query else ""
+        return f"{url.netloc}{url.path}{query}|{version}|{int(validators['length'])}"
+
+    @staticmethod
+    def hash_file(filepath: str) -> str:
+        digest = hashlib.sha256()
+        with open(filepath, "rb") as file:
+            for chunk in iter(lambda: file.read(BlobStore.HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get_blob_path(self, digest: str) -> str:
+        return os.path.join(self.blobs_path, digest[:2], digest)
+
+    def lookup(self, validators: Dict) -> Optional[str]:
+        """Return the digest stored for this download if its blob exists"""
+        key = self.get_key(validators)
+        with self._lock:
+            digest = self.index.get(key) if key else None
+
+        if digest and os.path.exists(self.get_blob_path(digest)):
+            return digest
+        return None
+
+    def fetch(self, validators: Dict, filepath: str) -> Optional[str]:
+        """
+        Link a known download into filepath
+
+        Returns:
+            Digest of the file if it was served from the store, else None
+        """
+        digest = self.lookup(validators)
+        if digest is None:
+            return None
+
+        self.link(digest, filepath)
+        return digest
+
+    def add(self, filepath: str, validators: Optional[Dict] = None) -> str:
+        """
+        Move a downloaded file into the store and link it back in place
+
+        Args:
+            filepath: Path of the downloaded file
+            validators: Response validators used to index the blob
+
+        Returns:
+            SHA-256 digest of the file
+        """
+        digest = self.hash_file(filepath)
+        blob_path = self.get_blob_path(digest)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+
+        is_new = False
+        with self._lock:
+            if not os.path.exists(blob_path):
+                is_new = True
+                try:
+                    os.link(filepath, blob_path)
+                except OSError:
+                    shutil.copyfile(filepath, blob_path)
+
+            key = self.get_key(validators) if validators else None
+            if key and self.index.get(key) != digest:
+                self.index[key] = digest
+                self._save_index()
+
+        # An existing blob replaces the fresh copy, so duplicates share storage
+        if not is_new and not self._is_same_file(blob_path, filepath):
+            self.link(digest, filepath)
+        return digest
+
+    def link(self, digest: str, filepath: str) -> None:
+        """Place the blob at filepath, as a hardlink, a reflink or a copy"""
+        blob_path = self.get_blob_path(digest)
+        tmp_path = f"{filepath}.{digest[:8]}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            if not self._reflink(blob_path, tmp_path):
+                shutil.copyfile(blob_path, tmp_path)
+        os.replace(tmp_path, filepath)
+
+    @staticmethod
+    def _reflink(src: str, dst: str) -> bool:
+        """Copy-on-write clone (btrfs, xfs), only available on Linux"""
+        if not sys.platform.startswith("linux"):
+            return False
+
+        import fcntl
+
+        try:
+            with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            return True
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+            return False
+
+    @staticmethod
+    def _is_same_file(first: str, second: str) -> bool:
+        try:
+            return os.path.samefile(first, second)
+        except OSError:
+            return False
+
+    def _load_index(self) -> Dict[str, str]:
+        if not os.path.exists(self.index_path):
+            return {}
+
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_index(self) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)